@@ -0,0 +1,608 @@
+/*
+ * ゲームのページで共有するスクリプト
+ *
+ * _templates/global/_GameAssets.html から defer で読み込む（全ページ共通）。
+ * 各ページの処理は DOMContentLoaded で、そのページにある要素を見つけたときだけ動く。
+ * テンプレートから値を渡すときは data- 属性を使い、インラインの <script> は書かない。
+ * このファイルを変更したら _GameAssets.html の ?v= を上げること（ブラウザのキャッシュを更新するため）。
+ */
+
+// ---- live_method の返信を type ごとの処理に振り分ける ----
+var liveHandlers = {};
+
+function liveRecv(data) {
+    var handler = data && liveHandlers[data.type];
+    if (handler) {
+        handler(data);
+    }
+}
+
+// ---- 全ページ共通（言語・必須項目のメッセージ・Enter キーで次へ） ----
+document.addEventListener('DOMContentLoaded', function () {
+    if (document && document.documentElement) {
+        document.documentElement.setAttribute('lang', 'ja');
+    }
+    document.querySelectorAll('[required]').forEach(function (el) {
+        el.addEventListener('invalid', function () {
+            this.setCustomValidity('この項目は必須です。');
+        });
+        el.addEventListener('input', function () {
+            this.setCustomValidity('');
+        });
+    });
+
+    document.addEventListener('keydown', function (event) {
+        if (event.key !== 'Enter') {
+            return;
+        }
+
+        var active = document.activeElement;
+        var tag = active ? active.tagName : '';
+        if (active && (
+            active.isContentEditable ||
+            tag === 'INPUT' ||
+            tag === 'TEXTAREA' ||
+            tag === 'SELECT'
+        )) {
+            return;
+        }
+
+        var nextButton = document.querySelector('button.otree-btn-next');
+        if (nextButton && nextButton.disabled) {
+            return;
+        }
+
+        var form = document.querySelector('form.otree-form');
+        if (!form) {
+            return;
+        }
+
+        event.preventDefault();
+
+        if (typeof form.requestSubmit === 'function') {
+            form.requestSubmit();
+        } else {
+            form.submit();
+        }
+    });
+});
+
+// ---- 数値入力欄に ▲▼ ボタンを付ける ----
+function enhanceNumericInput(input, options) {
+    if (!input || input.dataset.numericStepper === 'true') {
+        return;
+    }
+    var step = options.step || 1;
+    var min = typeof options.min === 'number' ? options.min : 0;
+    var max = typeof options.max === 'number' ? options.max : Infinity;
+    var decimals = options.decimals != null ? options.decimals : (Number.isInteger(step) ? 0 : (step.toString().split('.')[1] || '').length);
+
+    var wrapper = document.createElement('div');
+    wrapper.className = 'numeric-step-wrapper';
+    if (options.width) {
+        wrapper.style.width = options.width;
+    }
+
+    var parent = input.parentNode;
+    parent.insertBefore(wrapper, input);
+    wrapper.appendChild(input);
+
+    input.classList.add('numeric-step-input');
+    input.dataset.numericStepper = 'true';
+
+    var buttons = document.createElement('div');
+    buttons.className = 'numeric-step-buttons';
+
+    var upBtn = document.createElement('button');
+    upBtn.type = 'button';
+    upBtn.textContent = '▲';
+    buttons.appendChild(upBtn);
+
+    var downBtn = document.createElement('button');
+    downBtn.type = 'button';
+    downBtn.textContent = '▼';
+    buttons.appendChild(downBtn);
+
+    wrapper.appendChild(buttons);
+
+    function formatValue(value) {
+        return value.toFixed(decimals);
+    }
+
+    function adjust(direction) {
+        var current = parseFloat(input.value);
+        if (Number.isNaN(current)) {
+            current = 0;
+        }
+        var next = current + direction * step;
+        if (next < min) {
+            next = min;
+        }
+        if (Number.isFinite(max)) {
+            next = Math.min(next, max);
+        }
+        next = Math.round(next / step) * step;
+        input.value = formatValue(next);
+        input.dispatchEvent(new Event('input', { bubbles: true }));
+        input.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+
+    upBtn.addEventListener('click', function (event) {
+        event.preventDefault();
+        adjust(1);
+    });
+
+    downBtn.addEventListener('click', function (event) {
+        event.preventDefault();
+        adjust(-1);
+    });
+}
+
+// ---- 入力中の値の検証（game/_LiveValidation.html） ----
+// 値をサーバーの error_message と同じ関数で検証し、エラーを表示して次へボタンを無効にする
+var liveValidate = (function () {
+    var DELAY_MS = 250;
+    var seq = 0;
+    var timer = null;
+
+    liveHandlers.validation = function (data) {
+        // 後から送った値の結果だけを反映する
+        if (data.seq !== seq) {
+            return;
+        }
+        var errorEl = document.getElementById('live-validation-error');
+        if (errorEl) {
+            errorEl.textContent = data.error || '';
+            errorEl.classList.toggle('d-none', !data.error);
+        }
+        document.querySelectorAll('.otree-btn-next').forEach(function (button) {
+            button.disabled = !!data.error;
+        });
+    };
+
+    return function (value) {
+        if (!document.getElementById('live-validation-error')) {
+            return;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            seq += 1;
+            liveSend({ type: 'validate', seq: seq, value: value });
+        }, DELAY_MS);
+    };
+})();
+
+// ---- 待機ページの進捗（他の参加者が入力を終えるとサーバーから届く） ----
+liveHandlers.progress = function (data) {
+    document.getElementById('waiting-progress').textContent = data.submitted;
+    document.getElementById('waiting-total').textContent = data.total;
+};
+
+document.addEventListener('DOMContentLoaded', function () {
+    // 全員そろうと oTree が次のページへ移動させる
+    if (document.getElementById('waiting-progress') && typeof liveSend === 'function') {
+        liveSend({});
+    }
+});
+
+// ---- 履歴モーダル（game/_HistoryModal.html） ----
+var historyState = { page: null, numPages: 0, loaded: false };
+
+function historyHeaderCells(players) {
+    return players.map(function (entry) {
+        return '<th>プレイヤー ' + entry.id_in_group + ' から</th>';
+    }).join('');
+}
+
+function historySummaryRow(label, players, render) {
+    return '<tr><td><strong>' + label + '</strong></td>' + players.map(function (entry) {
+        return '<td>' + render(entry) + '</td>';
+    }).join('') + '</tr>';
+}
+
+function historyMatrixRows(rows, idKey) {
+    return rows.map(function (row) {
+        return '<tr><td><strong>プレイヤー ' + row[idKey] + '</strong></td>' + row.cells.map(function (cell) {
+            return '<td>' + (cell === null ? '-' : cell) + '</td>';
+        }).join('') + '</tr>';
+    }).join('');
+}
+
+function renderHistoryRound(round) {
+    var players = round.players;
+    var html = '<div class="card mb-3"><div class="card-header"><strong>ラウンド ' + round.round_number + ' の結果</strong></div><div class="card-body">';
+
+    html += '<table class="table table-bordered text-center table-sm"><tbody><tr class="thead-light"><th></th>';
+    html += players.map(function (entry) { return '<th>プレイヤー ' + entry.id_in_group + '</th>'; }).join('') + '</tr>';
+    html += historySummaryRow('ラウンド貢献金額', players, function (e) { return e.contribution + ' / ' + e.endowment; });
+    if (round.has_power_transfer) {
+        html += historySummaryRow('罰威力', players, function (e) { return e.power_after_display + ' / 1.0'; });
+        html += historySummaryRow('譲渡 / 受取', players, function (e) { return '- ' + e.power_transfer_out_display + ' / + ' + e.power_transfer_in_display; });
+        html += historySummaryRow('移譲コスト', players, function (e) { return e.power_transfer_cost; });
+    }
+    if (round.has_punishment) {
+        html += historySummaryRow('消費罰ポイント', players, function (e) { return e.punishment_sent_total; });
+    }
+    html += '</tbody></table>';
+
+    if (round.has_power_transfer) {
+        html += '<h6 class="mt-3">罰威力の移譲履歴</h6><table class="table table-bordered text-center table-sm"><thead class="thead-light"><tr><th>↓移譲先 / 移譲元→</th>';
+        html += historyHeaderCells(players) + '</tr></thead><tbody>' + historyMatrixRows(round.transfer_rows, 'giver_id') + '</tbody></table>';
+    }
+    if (round.has_punishment) {
+        html += '<h6 class="mt-3">罰交換のMatrix</h6><table class="table table-bordered text-center table-sm"><thead class="thead-light"><tr><th>↓受けた人 / 与えた人→</th>';
+        html += historyHeaderCells(players) + '</tr></thead><tbody>' + historyMatrixRows(round.matrix_rows, 'victim_id') + '</tbody></table>';
+    }
+    return html + '</div></div>';
+}
+
+function renderHistoryPage(data) {
+    historyState.page = data.page;
+    historyState.numPages = data.num_pages;
+    historyState.loaded = true;
+
+    var container = document.getElementById('history-rounds');
+    if (!data.rounds.length) {
+        container.innerHTML = '<p class="text-center text-muted">表示できる履歴がありません。</p>';
+    } else {
+        container.innerHTML = data.rounds.map(renderHistoryRound).join('');
+    }
+    document.getElementById('history-prev').disabled = data.page <= 0;
+    document.getElementById('history-next').disabled = data.page >= data.num_pages - 1;
+    document.getElementById('history-page-label').textContent = (data.page + 1) + ' / ' + data.num_pages;
+}
+
+liveHandlers.history = renderHistoryPage;
+
+function requestHistoryPage(page) {
+    liveSend({ type: 'history', page: page });
+}
+
+document.addEventListener('DOMContentLoaded', function () {
+    var modalEl = document.getElementById('historyModal');
+    if (!modalEl) {
+        return;
+    }
+
+    var triggers = document.querySelectorAll('[data-history-modal="true"]');
+    if (!triggers.length) {
+        return;
+    }
+
+    var closeButtons = modalEl.querySelectorAll('[data-dismiss="modal"], [data-history-close="true"]');
+    var backdropEl = null;
+
+    function createBackdrop() {
+        backdropEl = document.createElement('div');
+        backdropEl.className = 'custom-history-backdrop';
+        document.body.appendChild(backdropEl);
+    }
+
+    function removeBackdrop() {
+        if (backdropEl && backdropEl.parentNode) {
+            backdropEl.parentNode.removeChild(backdropEl);
+        }
+        backdropEl = null;
+    }
+
+    function showModal(event) {
+        if (event) {
+            event.preventDefault();
+        }
+
+        if (window.bootstrap && window.bootstrap.Modal) {
+            var modalInstance = window.bootstrap.Modal.getOrCreateInstance(modalEl);
+            modalInstance.show();
+            return;
+        }
+
+        var jq = window.jQuery || window.$;
+        if (jq && typeof jq(modalEl).modal === 'function') {
+            jq(modalEl).modal('show');
+            return;
+        }
+
+        if (modalEl.classList.contains('manual-show')) {
+            return;
+        }
+
+        modalEl.classList.add('manual-show', 'show');
+        modalEl.removeAttribute('aria-hidden');
+        createBackdrop();
+        document.body.classList.add('modal-open');
+    }
+
+    function hideModal(event) {
+        if (event) {
+            event.preventDefault();
+        }
+
+        if (window.bootstrap && window.bootstrap.Modal) {
+            var modalInstance = window.bootstrap.Modal.getOrCreateInstance(modalEl);
+            modalInstance.hide();
+            return;
+        }
+
+        var jq = window.jQuery || window.$;
+        if (jq && typeof jq(modalEl).modal === 'function') {
+            jq(modalEl).modal('hide');
+            return;
+        }
+
+        modalEl.classList.remove('manual-show', 'show');
+        modalEl.setAttribute('aria-hidden', 'true');
+        removeBackdrop();
+        document.body.classList.remove('modal-open');
+    }
+
+    triggers.forEach(function (btn) {
+        btn.addEventListener('click', function () {
+            if (!historyState.loaded) {
+                requestHistoryPage(null);
+            }
+        });
+        btn.addEventListener('click', showModal);
+    });
+
+    document.getElementById('history-prev').addEventListener('click', function () {
+        requestHistoryPage(historyState.page - 1);
+    });
+    document.getElementById('history-next').addEventListener('click', function () {
+        requestHistoryPage(historyState.page + 1);
+    });
+
+    closeButtons.forEach(function (btn) {
+        btn.addEventListener('click', hideModal);
+    });
+
+    modalEl.addEventListener('click', function (event) {
+        if (event.target === modalEl) {
+            hideModal(event);
+        }
+    });
+});
+
+// ---- 貢献ページ（game/Contribution.html） ----
+document.addEventListener('DOMContentLoaded', function () {
+    var configEl = document.getElementById('contribution-config');
+    var contributionInput = document.querySelector('input[name="contribution"]');
+    if (!configEl || !contributionInput) {
+        return;
+    }
+
+    var maxVal = parseFloat(configEl.dataset.available);
+    if (!Number.isFinite(maxVal)) {
+        maxVal = 0;
+    }
+
+    var current = parseFloat(contributionInput.value);
+    if (Number.isNaN(current) || current < 0) {
+        contributionInput.value = '0';
+    } else {
+        contributionInput.value = Math.round(current).toString();
+    }
+
+    contributionInput.setAttribute('step', '1');
+    contributionInput.setAttribute('min', '0');
+    contributionInput.setAttribute('max', maxVal.toString());
+
+    enhanceNumericInput(contributionInput, {
+        step: 1,
+        min: 0,
+        max: maxVal,
+        decimals: 0,
+        width: '7rem'
+    });
+
+    ['input', 'change'].forEach(function (eventName) {
+        contributionInput.addEventListener(eventName, function () {
+            liveValidate(contributionInput.value);
+        });
+    });
+});
+
+// ---- 罰ページ（game/Punishment.html） ----
+document.addEventListener('DOMContentLoaded', function () {
+    var edgesInput = document.getElementById('punishments-input');
+    if (!edgesInput) {
+        return;
+    }
+    var inputs = document.querySelectorAll('.punishment-input');
+    var usedPointsSpan = document.getElementById('used-points');
+    var totalDeductionPoints = parseInt(document.getElementById('total-deduction-points').innerText);
+    var maxPerTarget = Number.isNaN(totalDeductionPoints) ? Infinity : totalDeductionPoints;
+
+    function updateTotal() {
+        var totalUsed = 0;
+        var edges = {};
+        inputs.forEach(function (input) {
+            var value = parseInt(input.value);
+            if (!isNaN(value) && value > 0) {
+                totalUsed += value;
+                edges[input.dataset.receiver] = value;
+            }
+        });
+        usedPointsSpan.innerText = totalUsed;
+        edgesInput.value = JSON.stringify(edges);
+        liveValidate(edgesInput.value);
+
+        if (totalUsed > totalDeductionPoints) {
+            usedPointsSpan.style.color = 'red';
+            usedPointsSpan.style.fontWeight = 'bold';
+        } else {
+            usedPointsSpan.style.color = 'black';
+            usedPointsSpan.style.fontWeight = 'normal';
+        }
+    }
+
+    inputs.forEach(function (input) {
+        input.setAttribute('step', '1');
+        input.setAttribute('min', '0');
+        if (Number.isFinite(maxPerTarget)) {
+            input.setAttribute('max', maxPerTarget.toString());
+        }
+        enhanceNumericInput(input, {
+            step: 1,
+            min: 0,
+            max: maxPerTarget,
+            decimals: 0,
+            width: '6.5rem'
+        });
+        input.addEventListener('input', updateTotal);
+    });
+
+    updateTotal();
+});
+
+// ---- 罰威力移譲ページ（game/PowerTransfer.html） ----
+document.addEventListener('DOMContentLoaded', function () {
+    var configEl = document.getElementById('transfer-config');
+    if (!configEl) {
+        return;
+    }
+
+    var maxTransfer = parseFloat(configEl.dataset.maxTransfer || '0');
+    var currentPower = parseFloat(configEl.dataset.currentPower || '0');
+    if (!Number.isFinite(maxTransfer) || maxTransfer <= 0) {
+        maxTransfer = currentPower;
+    }
+
+    var transferUnit = parseFloat(configEl.dataset.transferUnit || '0.1');
+    if (!Number.isFinite(transferUnit) || transferUnit <= 0) {
+        transferUnit = 0.1;
+    }
+
+    var unitString = transferUnit.toString();
+    var decimalPart = unitString.indexOf('.') >= 0 ? unitString.split('.')[1] : '';
+    var decimals = decimalPart.length;
+    if (decimals === 0 && transferUnit < 1) {
+        decimals = 1;
+    }
+    decimals = Math.min(Math.max(decimals, 1), 4);
+    var displayDecimals = Math.max(decimals, 1);
+
+    var isCostly = configEl.dataset.isCostly === 'true';
+    var costPerUnit = parseFloat(configEl.dataset.costPerUnit || '0');
+
+    var inputs = Array.from(document.querySelectorAll('.js-transfer-input'));
+    var stepButtons = Array.from(document.querySelectorAll('.js-transfer-step'));
+    var totalOutEl = document.getElementById('total-transfer-out');
+    var remainingEl = document.getElementById('remaining-power');
+    var previewPowerEl = document.getElementById('preview-power');
+    var costEl = document.getElementById('preview-cost');
+    var errorEl = document.getElementById('transfer-error');
+    var edgesInput = document.getElementById('power-transfers-input');
+    var form = document.getElementById('power-transfer-form');
+    var submitButton = form ? form.querySelector('button.otree-btn-next') : null;
+
+    function clampToUnit(value) {
+        var scaled = Math.round(value / transferUnit) * transferUnit;
+        return Math.max(0, parseFloat(scaled.toFixed(decimals + 1)));
+    }
+
+    function setInputValue(input, value) {
+        var normalized = clampToUnit(value);
+        input.value = normalized.toFixed(displayDecimals);
+    }
+
+    function adjustInputValue(input, direction) {
+        if (!input) {
+            return;
+        }
+        var current = parseFloat(input.value);
+        if (Number.isNaN(current)) {
+            current = 0;
+        }
+        var nextValue = current + direction * transferUnit;
+        if (nextValue < 0) {
+            nextValue = 0;
+        }
+        setInputValue(input, nextValue);
+        updateTotals(true);
+        input.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+
+    function updateTotals(enforceFormat) {
+        var totalOut = 0;
+        var edges = {};
+
+        inputs.forEach(function (input) {
+            var rawText = input.value;
+            var raw = parseFloat(rawText);
+            if (Number.isNaN(raw) || raw < 0) {
+                raw = 0;
+            }
+            var normalized = clampToUnit(raw);
+            if (enforceFormat) {
+                input.value = normalized.toFixed(displayDecimals);
+            }
+            totalOut += normalized;
+            if (normalized > 0) {
+                edges[input.dataset.target] = normalized;
+            }
+        });
+        if (edgesInput) {
+            edgesInput.value = JSON.stringify(edges);
+            liveValidate(edgesInput.value);
+        }
+
+        totalOut = parseFloat(totalOut.toFixed(decimals + 1));
+        var exceeds = totalOut > maxTransfer + 1e-6;
+
+        if (totalOutEl) {
+            totalOutEl.textContent = totalOut.toFixed(displayDecimals);
+        }
+
+        var remaining = currentPower - totalOut;
+        if (remainingEl) {
+            remainingEl.textContent = remaining.toFixed(displayDecimals);
+        }
+        if (previewPowerEl) {
+            previewPowerEl.textContent = remaining.toFixed(displayDecimals);
+        }
+
+        if (isCostly && costEl) {
+            var units = totalOut / transferUnit;
+            var totalCost = units * costPerUnit;
+            costEl.textContent = totalCost.toFixed(displayDecimals);
+        }
+
+        if (errorEl) {
+            if (exceeds) {
+                errorEl.textContent = '譲渡量の合計が保有する罰威力 (' + currentPower.toFixed(displayDecimals) + ') を超えています。値を修正してください。';
+                errorEl.classList.remove('d-none');
+            } else {
+                errorEl.classList.add('d-none');
+                errorEl.textContent = '';
+            }
+        }
+
+        if (submitButton) {
+            submitButton.disabled = exceeds;
+        }
+    }
+
+    inputs.forEach(function (input) {
+        input.addEventListener('input', function () { updateTotals(false); });
+        input.addEventListener('change', function () { updateTotals(true); });
+        input.addEventListener('blur', function () { updateTotals(true); });
+    });
+
+    stepButtons.forEach(function (button) {
+        var direction = parseFloat(button.dataset.direction || '0');
+        if (!Number.isFinite(direction) || direction === 0) {
+            return;
+        }
+        button.addEventListener('click', function (event) {
+            event.preventDefault();
+            var targetId = button.dataset.target;
+            if (!targetId) {
+                return;
+            }
+            var targetInput = document.getElementById(targetId);
+            adjustInputValue(targetInput, direction);
+        });
+    });
+
+    updateTotals(true);
+});
@@ -1,7 +1,15 @@
 from otree.api import *
 
-from .models import Constants as C, Subsession, Group, Player  # type: ignore
+from .models import (  # type: ignore
+    Constants as C,
+    Subsession,
+    Group,
+    Player,
+    creating_session,
+    group_by_arrival_time_method,
+)
 from .pages import (
+    ArrivalWaitPage,
     PowerTransfer,
     PowerTransferWait,
     PowerTransferResult,
@@ -13,12 +21,16 @@ from .pages import (
     RoundResult,
     FinalResult,
 )  # type: ignore
+from .export import custom_export  # type: ignore
+from .profiling import custom_export_page_profile  # type: ignore
+from .audit import custom_export_audit  # type: ignore
 
 doc = """
 Public goods game with punishment for the Leviathan project.
 """
 
 page_sequence = [
+    ArrivalWaitPage,
     PowerTransfer,
     PowerTransferWait,
     PowerTransferResult,
@@ -0,0 +1,160 @@
+# game/audit.py
+"""
+精算の不変条件チェック
+
+各精算待機ページの after_all_players_arrive の最後に audit_group() を呼び、
+そのグループの精算結果が利得のルールと矛盾しないかを確認する。メモリ上の
+メンバー (group_context) だけを見るため追加のクエリは発生せず、計算量は
+グループの人数に比例する。違反は AuditViolation に保存し、ロガー
+'game.audit' に JSON で出力する。custom_export_audit でダウンロードできる。
+"""
+
+import json
+import logging
+
+from otree.api import Currency as c
+
+from .models import AuditViolation, group_context, treatment_params
+
+logger = logging.getLogger('game.audit')
+
+TOLERANCE = 1e-6
+
+
+def violation(check, expected, actual, player=None):
+    return dict(
+        check=check,
+        id_in_group=player.id_in_group if player else 0,
+        expected=str(expected),
+        actual=str(actual),
+    )
+
+
+def check_power_transfer(group, members):
+    """移譲の前後でグループ全体の罰威力が変わらない"""
+    total_before = total_after = 0
+    for p in members:
+        before = p.punishment_power_before
+        after = p.punishment_power_after
+        out_total = p.power_transfer_out_total
+        total_before += before
+        total_after += after
+        if out_total > before + TOLERANCE:
+            yield violation('transfer_within_power', before, out_total, p)
+        if after < 0:
+            yield violation('power_non_negative', 0, after, p)
+    if abs(total_before - total_after) > TOLERANCE * len(members):
+        yield violation('power_conserved', round(total_before, 6), round(total_after, 6))
+
+
+def check_contribution(group, members):
+    """総貢献額と取り分が各自の貢献額と一致する"""
+    total = sum(p.contribution for p in members)
+    if group.total_contribution != total:
+        yield violation('total_contribution', total, group.total_contribution)
+    multiplier = treatment_params(group.session).contribution_multiplier
+    share = c(float(total) * multiplier / len(members))
+    if group.individual_share != share:
+        yield violation('individual_share', share, group.individual_share)
+    for p in members:
+        available = p.available_before_contribution
+        if p.contribution > available:
+            yield violation('contribution_within_available', available, p.contribution, p)
+
+
+def check_payoff(group, members):
+    """利得の式・懲罰の上限・累積利得"""
+    endowment = treatment_params(group.session).endowment
+    share = group.individual_share
+    for p in members:
+        expected = (
+            endowment - p.contribution + share
+            - (p.punishment_given + p.punishment_received + p.power_transfer_cost)
+        )
+        payoff = p.payoff
+        if payoff != expected:
+            yield violation('payoff_formula', expected, payoff, p)
+        # settle_punishments は罰のコストと損失をそれぞれ available_before_punishment
+        # までに抑える（両方の合計はこれを超えることがある）
+        available = p.available_before_punishment
+        if p.punishment_given > available:
+            yield violation('punishment_cost_within_available', available, p.punishment_given, p)
+        if p.punishment_received > available:
+            yield violation('punishment_loss_within_available', available, p.punishment_received, p)
+        if p.available_endowment < 0:
+            yield violation('available_non_negative', 0, p.available_endowment, p)
+        cumulative = p.previous_cumulative_payoff + payoff
+        if p.cumulative_payoff != cumulative:
+            yield violation('cumulative_payoff', cumulative, p.cumulative_payoff, p)
+
+
+def check_participant_payoff(group, members):
+    """ラウンドごとに引き継いだ累積利得が oTree の participant.payoff と一致する"""
+    for p in members:
+        participant = p.participant
+        if p.cumulative_payoff != participant.payoff:
+            yield violation('participant_payoff', participant.payoff, p.cumulative_payoff, p)
+
+
+CHECKS = dict(
+    power_transfer=[check_power_transfer],
+    contribution=[check_contribution],
+    payoff=[check_payoff, check_participant_payoff],
+)
+
+# participant.payoff は後のラウンドでも増えるので、精算の時点でしか確認できない
+SETTLEMENT_ONLY_CHECKS = {check_participant_payoff}
+
+
+def find_violations(group, members, phases, settled_now=True):
+    """members の phases の精算結果を確認し、違反のリストを返す（記録はしない）
+
+    settled_now=False なら、セッションの終了後にも成り立つチェックだけを行う
+    （tools/run_bots.py が保存済みの全ラウンドを確認するとき）。
+    """
+    found = []
+    for phase in phases:
+        for check in CHECKS[phase]:
+            if not settled_now and check in SETTLEMENT_ONLY_CHECKS:
+                continue
+            for item in check(group, members):
+                found.append(dict(item, phase=phase))
+    return found
+
+
+def audit_group(group, *phases):
+    """group の精算結果を確認し、違反を記録して返す"""
+    found = find_violations(group, group_context(group).players, phases)
+    if found:
+        session_code = group.session.code
+        for item in found:
+            record = dict(
+                session_code=session_code,
+                round_number=group.round_number,
+                group_id=group.id_in_subsession,
+                **item,
+            )
+            AuditViolation.create(**record)
+            logger.warning(json.dumps(record, ensure_ascii=False))
+    return found
+
+
+AUDIT_HEADER = [
+    'session_code',
+    'round_number',
+    'group_id',
+    'id_in_group',
+    'phase',
+    'check',
+    'expected',
+    'actual',
+]
+
+
+def custom_export_audit(players):
+    """不変条件の違反の一覧（違反が無いセッションは行が出ない）"""
+    yield AUDIT_HEADER
+    for session_code in sorted({p.session.code for p in players}):
+        violations = AuditViolation.objects_filter(session_code=session_code)
+        for v in sorted(violations, key=lambda v: (v.round_number, v.group_id, v.id_in_group, v.id)):
+            yield [getattr(v, column) for column in AUDIT_HEADER]
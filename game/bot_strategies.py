@@ -0,0 +1,211 @@
+# game/bot_strategies.py
+"""
+ボット用の意思決定戦略
+
+session.config['bot_strategy'] で戦略を選ぶ。'mixed' を指定すると参加者ごとに
+戦略を順番に割り当てる。各戦略はページのバリデーションを通る値を返す。
+"""
+
+import random
+
+from .models import treatment_params
+
+
+def contribution_limit(player):
+    """貢献できる最大額（整数）"""
+    return int(float(player.available_endowment or 0))
+
+
+def punishment_limit(player):
+    """罰ポイントの合計の上限（罰ポイント数と保有額の両方を考慮）"""
+    params = treatment_params(player.session)
+    deduction_points = params.deduction_points
+    cost = params.punishment_cost
+    if cost <= 0:
+        return deduction_points
+    return min(deduction_points, int(float(player.available_endowment or 0) // cost))
+
+
+def transfer_units(player):
+    """移譲できる最大単位数"""
+    unit = treatment_params(player.session).punishment_transfer_unit
+    return int(player.punishment_power_before / unit + 1e-9)
+
+
+def split_points(total, targets, rng):
+    """total を targets にランダムに配分"""
+    points = {target: 0 for target in targets}
+    for _ in range(total):
+        points[rng.choice(targets)] += 1
+    return points
+
+
+class Strategy:
+    name = None
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def contribution(self, player):
+        raise NotImplementedError
+
+    def punishment(self, player, targets):
+        """targets: 罰を与えられる相手の id_in_group のリスト"""
+        raise NotImplementedError
+
+    def power_transfer(self, player, others):
+        """others: 自分以外の id_in_group のリスト。戻り値は移譲する単位数"""
+        raise NotImplementedError
+
+    # 範囲外の値を送信してバリデーションを確認するか
+    submit_invalid = False
+
+    def times_out(self):
+        """次の意思決定ページを時間切れにするか（サーバー側の既定の行動で進む）"""
+        return False
+
+
+class ConstantStrategy(Strategy):
+    """従来の固定値ボット（移譲条件は全員に貢献・罰、固定条件は何もしない）"""
+
+    name = 'constant'
+
+    def contribution(self, player):
+        if treatment_params(player.session).power_transfer_allowed:
+            return 10
+        return 0
+
+    def punishment(self, player, targets):
+        points = 1 if treatment_params(player.session).power_transfer_allowed else 0
+        return {target: points for target in targets}
+
+    def power_transfer(self, player, others):
+        return {other: 1 for other in others}
+
+
+class RandomStrategy(Strategy):
+    name = 'random'
+
+    def contribution(self, player):
+        return self.rng.randint(0, contribution_limit(player))
+
+    def punishment(self, player, targets):
+        if not targets:
+            return {}
+        total = self.rng.randint(0, punishment_limit(player))
+        return split_points(total, targets, self.rng)
+
+    def power_transfer(self, player, others):
+        total = self.rng.randint(0, transfer_units(player))
+        return split_points(total, others, self.rng)
+
+
+class FreeRiderStrategy(Strategy):
+    name = 'free_rider'
+
+    def contribution(self, player):
+        return 0
+
+    def punishment(self, player, targets):
+        return {target: 0 for target in targets}
+
+    def power_transfer(self, player, others):
+        return {other: 0 for other in others}
+
+
+class HeavyPunisherStrategy(Strategy):
+    """貢献は中程度、罰は使える上限まで全員に配分"""
+
+    name = 'heavy_punisher'
+
+    def contribution(self, player):
+        return contribution_limit(player) // 2
+
+    def punishment(self, player, targets):
+        if not targets:
+            return {}
+        return split_points(punishment_limit(player), targets, self.rng)
+
+    def power_transfer(self, player, others):
+        return {other: 0 for other in others}
+
+
+class PowerConcentratorStrategy(Strategy):
+    """罰威力をすべてグループ内の 1 人（id が最小の相手）に集める"""
+
+    name = 'power_concentrator'
+
+    def contribution(self, player):
+        return contribution_limit(player)
+
+    def punishment(self, player, targets):
+        return {target: 0 for target in targets}
+
+    def power_transfer(self, player, others):
+        units = {other: 0 for other in others}
+        units[min(others)] = transfer_units(player)
+        return units
+
+
+class BoundaryStrategy(Strategy):
+    """すべての入力を上限ちょうどで送信し、上限を 1 超える値が拒否されることも確認"""
+
+    name = 'boundary'
+    submit_invalid = True
+
+    def contribution(self, player):
+        return contribution_limit(player)
+
+    def punishment(self, player, targets):
+        points = {target: 0 for target in targets}
+        if targets:
+            points[targets[0]] = punishment_limit(player)
+        return points
+
+    def power_transfer(self, player, others):
+        units = {other: 0 for other in others}
+        units[others[-1]] = transfer_units(player)
+        return units
+
+
+class AbsentStrategy(RandomStrategy):
+    """ときどき時間切れになる参加者（それ以外はランダム）"""
+
+    name = 'absent'
+    timeout_rate = 0.5
+
+    def times_out(self):
+        return self.rng.random() < self.timeout_rate
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in [
+        ConstantStrategy,
+        RandomStrategy,
+        FreeRiderStrategy,
+        HeavyPunisherStrategy,
+        PowerConcentratorStrategy,
+        BoundaryStrategy,
+        AbsentStrategy,
+    ]
+}
+
+MIXED_ORDER = [
+    'random',
+    'free_rider',
+    'heavy_punisher',
+    'power_concentrator',
+    'boundary',
+]
+
+
+def get_strategy(session, participant, round_number):
+    """参加者・ラウンドごとに再現可能な乱数を持つ戦略を返す"""
+    name = session.config.get('bot_strategy', 'constant')
+    if name == 'mixed':
+        name = MIXED_ORDER[(participant.id_in_session - 1) % len(MIXED_ORDER)]
+    if name not in STRATEGIES:
+        raise ValueError(f'Unknown bot_strategy: {name}')
+    seed = f"{session.config.get('bot_seed', 0)}-{participant.id_in_session}-{round_number}"
+    return STRATEGIES[name](random.Random(seed))
@@ -0,0 +1,109 @@
+# game/export.py
+"""
+ロング形式のデータ出力
+
+custom_export は (ラウンド, 与えた人, 受けた人, 種類) ごとに 1 行を出力する。
+種類は punishment（罰ポイント）と power_transfer（罰威力の移譲）で、
+入力値 (attempted) と精算後の値 (actual) を並べる。行は入力または精算後の
+値が 0 でない組（辺）だけを出力するため、行数はグループの人数の 2 乗では
+なく辺の数に比例する。Player は (セッション, ラウンド, グループ) 順のクエリから
+EXPORT_CHUNK_SIZE 行ずつ読み込み、行はグループ単位で順に生成するので、
+出力全体もセッションの全プレイヤーも一度にメモリに載せない。
+"""
+
+from itertools import groupby
+
+from sqlalchemy.orm import joinedload
+
+from .models import Player, treatment_params
+
+# 1 回のフェッチで読み込む Player の行数
+EXPORT_CHUNK_SIZE = 500
+
+HEADER = [
+    'session_code',
+    'treatment',
+    'round_number',
+    'group_id',
+    'kind',
+    'giver_id_in_group',
+    'giver_participant_code',
+    'receiver_id_in_group',
+    'receiver_participant_code',
+    'attempted',
+    'actual',
+    'loss',
+]
+
+
+def _group_key(player):
+    return (player.session_id, player.round_number, player.group_id)
+
+
+def iter_group_rows(members):
+    """1 グループ・1 ラウンド分の行（members は id_in_group 順）"""
+    first = members[0]
+    session = first.session
+    params = treatment_params(session)
+    group = first.group
+    round_number = first.round_number
+    prefix = [
+        session.code,
+        params.treatment_name,
+        round_number,
+        group.id_in_subsession,
+    ]
+    by_id = {member.id_in_group: member for member in members}
+
+    def pair(giver_id, receiver_id):
+        giver = by_id[giver_id]
+        receiver = by_id[receiver_id]
+        return [giver_id, giver.participant.code, receiver_id, receiver.participant.code]
+
+    if round_number > 1:
+        attempted = group.edges('punishment_attempted')
+        points = group.edges('punishment_points')
+        loss = group.edges('punishment_loss')
+        for edge in sorted(attempted.keys() | points.keys()):
+            yield prefix + ['punishment'] + pair(*edge) + [
+                attempted.get(edge, 0),
+                points.get(edge, 0),
+                loss.get(edge, 0),
+            ]
+
+    if params.has_power_transfer(round_number):
+        transfers = group.edges('power_transfer')
+        submitted = {member.id_in_group: member.power_transfers_sent() for member in members}
+        for (giver_id, receiver_id), amount in sorted(transfers.items()):
+            yield prefix + ['power_transfer'] + pair(giver_id, receiver_id) + [
+                submitted[giver_id].get(receiver_id, 0),
+                amount,
+                '',
+            ]
+
+
+def iter_players(session_ids):
+    """session_ids の Player を (セッション, ラウンド, グループ, id_in_group) 順に少しずつ読み込む"""
+    query = (
+        Player.objects_filter(Player.session_id.in_(session_ids))
+        .options(
+            joinedload(Player.group),
+            joinedload(Player.participant),
+            joinedload(Player.session),
+        )
+        .order_by(Player.session_id, Player.round_number, Player.group_id, Player.id_in_group)
+        .yield_per(EXPORT_CHUNK_SIZE)
+    )
+    return iter(query)
+
+
+def custom_export(players):
+    """罰・移譲のやり取りをロング形式で出力"""
+    yield HEADER
+    # oTree から渡される players からは対象のセッションだけを取り出し、
+    # 行は並べ替え済みのクエリから読み込みながらグループごとにまとめる
+    session_ids = sorted({p.session_id for p in players})
+    if not session_ids:
+        return
+    for _, members in groupby(iter_players(session_ids), key=_group_key):
+        yield from iter_group_rows(list(members))
@@ -1,3 +1,9 @@
+import json
+import random
+from collections import defaultdict
+from dataclasses import dataclass
+
+from otree import settings as otree_settings
 from otree.api import (
     models,
     widgets,
@@ -5,17 +11,25 @@ from otree.api import (
     BaseSubsession,
     BaseGroup,
     BasePlayer,
+    ExtraModel,
     Currency as c,
     currency_range,
 )
 
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload
+
+from .settlement import settle_punishments
+
 doc = """
 Public Goods Game with Punishment (Fixed)
 """
 
 class Constants(BaseConstants):
     name_in_url = 'game'
-    players_per_group = 5
+    # グループの人数は session.config['players_per_group'] で指定する
+    # (None にすると oTree は全員を 1 グループにするので、initialize_all_rounds で分割する)
+    players_per_group = None
     num_rounds = 20
     
     # settings.py からパラメータを取得
@@ -26,121 +40,411 @@ class Constants(BaseConstants):
     punishment_cost = 1
     power_effectiveness = 1
 
+
+DEFAULT_PLAYERS_PER_GROUP = 5
+
+EDGE_KINDS = ('punishment_attempted', 'punishment_points', 'punishment_loss', 'power_transfer')
+
+
+def _config_value(config, key, default, kind):
+    """session.config の値を kind (bool / int / float / str) として読む（型が違えば ValueError）"""
+    value = config.get(key, default)
+    if kind is bool:
+        if not isinstance(value, bool):
+            raise ValueError(f'{key} は True または False で指定してください（{value!r}）。')
+        return value
+    if kind is str:
+        return str(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f'{key} は数値で指定してください（{value!r}）。')
+    if kind is int:
+        if not float(value).is_integer():
+            raise ValueError(f'{key} は整数で指定してください（{value!r}）。')
+        return int(value)
+    return float(value)
+
+
+@dataclass(frozen=True)
+class TreatmentParams:
+    """実験条件のパラメータ
+
+    SESSION_CONFIGS の値から作り、セッション作成時 (initialize_all_rounds) に
+    検証する。未指定の値のデフォルトはここ（と Constants）にだけ置く。
+    ページやモデルからは treatment_params(session) で読む。
+    """
+
+    treatment_name: str
+    players_per_group: int
+    endowment: int
+    contribution_multiplier: float
+    deduction_points: int
+    punishment_cost: float
+    power_effectiveness: float
+    power_transfer_allowed: bool
+    costly_punishment_transfer: bool
+    power_transfer_cost_rate: float
+    punishment_transfer_unit: float
+    # 意思決定ページの制限時間（秒、0 は制限なし）
+    contribution_timeout_seconds: float
+    power_transfer_timeout_seconds: float
+    punishment_timeout_seconds: float
+    # True なら到着順にグループを作る（ArrivalWaitPage、ラウンドごとに組み直す）
+    group_by_arrival_time: bool
+
+    @classmethod
+    def from_config(cls, config):
+        # ページごとの指定が無ければ decision_timeout_seconds を使う
+        timeout = _config_value(config, 'decision_timeout_seconds', 0, float)
+        params = cls(
+            treatment_name=_config_value(config, 'treatment_name', config.get('name', ''), str),
+            players_per_group=_config_value(config, 'players_per_group', DEFAULT_PLAYERS_PER_GROUP, int),
+            endowment=_config_value(config, 'endowment', Constants.endowment, int),
+            contribution_multiplier=_config_value(config, 'contribution_multiplier', Constants.multiplier, float),
+            deduction_points=_config_value(config, 'deduction_points', Constants.deduction_points, int),
+            punishment_cost=_config_value(config, 'punishment_cost', Constants.punishment_cost, float),
+            power_effectiveness=_config_value(
+                config, 'power_effectiveness', Constants.power_effectiveness, float
+            ),
+            power_transfer_allowed=_config_value(config, 'power_transfer_allowed', False, bool),
+            costly_punishment_transfer=_config_value(config, 'costly_punishment_transfer', False, bool),
+            power_transfer_cost_rate=_config_value(config, 'power_transfer_cost_rate', 0.0, float),
+            punishment_transfer_unit=_config_value(config, 'punishment_transfer_unit', 0.1, float),
+            contribution_timeout_seconds=_config_value(config, 'contribution_timeout_seconds', timeout, float),
+            power_transfer_timeout_seconds=_config_value(
+                config, 'power_transfer_timeout_seconds', timeout, float
+            ),
+            punishment_timeout_seconds=_config_value(config, 'punishment_timeout_seconds', timeout, float),
+            group_by_arrival_time=_config_value(config, 'group_by_arrival_time', False, bool),
+        )
+        params.validate()
+        return params
+
+    def validate(self):
+        if self.players_per_group < 2:
+            raise ValueError('players_per_group は 2 以上にしてください。')
+        if self.endowment <= 0:
+            raise ValueError('endowment は正の値にしてください。')
+        if self.punishment_transfer_unit <= 0:
+            raise ValueError('punishment_transfer_unit は正の値にしてください。')
+        for name in (
+            'contribution_multiplier',
+            'deduction_points',
+            'punishment_cost',
+            'power_effectiveness',
+            'power_transfer_cost_rate',
+            'contribution_timeout_seconds',
+            'power_transfer_timeout_seconds',
+            'punishment_timeout_seconds',
+        ):
+            if getattr(self, name) < 0:
+                raise ValueError(f'{name} は 0 以上にしてください。')
+
+    def has_power_transfer(self, round_number):
+        """このラウンドに罰威力の移譲フェーズがあるか"""
+        return self.power_transfer_allowed and round_number >= 3
+
+    def timeout_seconds(self, phase):
+        """phase ('contribution' / 'power_transfer' / 'punishment') のページの制限時間（無ければ None）"""
+        return getattr(self, f'{phase}_timeout_seconds') or None
+
+
+def treatment_params(session):
+    """session の TreatmentParams（同じ DB セッション内では同じオブジェクトを返す）
+
+    group_context と同じく DB セッションの info に置くので、リクエストが終われば捨てられる。
+    """
+    state = sa_inspect(session, raiseerr=False)
+    if state is None:
+        # DB のモデルでないセッション（シミュレーションやベンチマーク用のダミー）は自身に持たせる
+        params = getattr(session, 'treatment_params', None)
+        if params is None:
+            params = session.treatment_params = TreatmentParams.from_config(session.config)
+        return params
+    if state.session is None:
+        return TreatmentParams.from_config(session.config)
+    cache = state.session.info.setdefault('treatment_params', {})
+    params = cache.get(session.id)
+    if params is None:
+        params = cache[session.id] = TreatmentParams.from_config(session.config)
+    return params
+
+
+def decode_edges(text):
+    """保存済みの {受けた人の id_in_group: 値} (JSON) を読み込む"""
+    if not text:
+        return {}
+    return {int(receiver): value for receiver, value in json.loads(text).items()}
+
+
+def encode_edges(edges):
+    """{受けた人の id_in_group: 値} を JSON にする（0 の辺は保存しない）"""
+    return json.dumps(
+        {str(receiver): value for receiver, value in sorted(edges.items()) if value},
+        separators=(',', ':'),
+    )
+
+
+def initial_player_state(params):
+    """ラウンド開始時のプレイヤーの初期値"""
+    endowment = c(params.endowment)
+    return dict(
+        punishment_power_before=1.0,
+        punishment_power_after=1.0,
+        power_transfer_out_total=0,
+        power_transfer_in_total=0,
+        power_transfer_cost=c(0),
+        available_endowment=endowment,
+        can_receive_punishment=True,
+        available_before_contribution=endowment,
+        available_before_punishment=endowment,
+        attempted_punishment_cost=c(0),
+        attempted_punishment_points=0,
+        punishment_points_given_actual=0,
+        punishment_points_received_actual=0,
+        power_transfers='',
+        previous_contribution=c(0),
+        previous_cumulative_payoff=c(0),
+        cumulative_payoff=c(0),
+        contribution_timed_out=False,
+        power_transfer_timed_out=False,
+        punishment_timed_out=False,
+    )
+
+
+def default_contribution(player):
+    """時間切れのときの貢献額（前ラウンドの貢献額。今の保有額を超える分は切り捨て）"""
+    limit = int(float(player.available_endowment or 0))
+    return min(int(float(player.previous_contribution or 0)), limit)
+
+
 class Subsession(BaseSubsession):
     def creating_session(self):
         # session.config から実験設定を読み込み、settings.py で柔軟に変更可能にする
-        self.group_randomly()
-        players = self.get_players()
-
-        for p in players:
-            if self.round_number == 1:
-                initial_power = 1.0
-                p.participant.vars['cumulative_payoff'] = c(0)
-                p.participant.vars['punishment_power'] = initial_power
-            else:
-                prev_round = p.in_round(self.round_number - 1)
-                initial_power = prev_round.punishment_power_after or p.participant.vars.get('punishment_power', 1.0)
-                p.participant.vars['punishment_power'] = initial_power
-
-            p.punishment_power_before = initial_power
-            p.punishment_power_after = initial_power
-            p.power_transfer_out_total = 0
-            p.power_transfer_in_total = 0
-            p.power_transfer_cost = c(0)
-            p.available_endowment = c(self.session.config.get('endowment', Constants.endowment))
-            p.can_receive_punishment = True
-            p.available_before_contribution = p.available_endowment
-            p.available_before_punishment = p.available_endowment
-            p.attempted_punishment_cost = c(0)
-            p.attempted_punishment_points = 0
-            p.punishment_points_given_actual = 0
-            p.punishment_points_received_actual = 0
-
-            for i in range(1, Constants.players_per_group + 1):
-                setattr(p, f'power_transfer_p{i}', 0)
+        # 全ラウンド分のグループ分けと初期値は第1ラウンドでまとめて設定する
+        if self.round_number == 1:
+            self.initialize_all_rounds()
+
+    def initialize_all_rounds(self):
+        """全ラウンドのグループ分けをメモリ上で計算し、まとめて書き込む
+
+        ラウンドごとに group_randomly() を呼ぶとグループ単位でコミットが発生する
+        ため、全ラウンドのプレイヤーとグループを 1 回ずつ読み込んで割り当てる。
+        プレイヤーの初期値は各ラウンドに到達した時点で Player.start_round が
+        前ラウンドの結果から設定する。
+
+        group_by_arrival_time のセッションでは、グループは各ラウンドの
+        ArrivalWaitPage で到着順に作るので、ここでは分割しない。
+        """
+        session = self.session
+        # 設定の誤りはここ（セッション作成時）で ValueError にする
+        params = treatment_params(session)
+        if not params.group_by_arrival_time:
+            self.assign_random_groups(params.players_per_group)
+
+    def assign_random_groups(self, size):
+        """全ラウンドについて、全員を size 人のグループにランダムに分ける"""
+        session = self.session
+        subsessions = {s.round_number: s for s in Subsession.objects_filter(session=session)}
+
+        groups_by_round = defaultdict(list)
+        for group in sorted(Group.objects_filter(session=session), key=lambda g: g.id_in_subsession):
+            groups_by_round[group.round_number].append(group)
+
+        players_by_round = defaultdict(list)
+        for p in sorted(Player.objects_filter(session=session), key=lambda p: p.participant_id):
+            players_by_round[p.round_number].append(p)
+
+        for round_number, players in players_by_round.items():
+            if len(players) % size:
+                raise ValueError(
+                    f'参加者数 ({len(players)}) は players_per_group ({size}) の倍数にしてください。'
+                )
+            # oTree が作るのはラウンドごとに 1 グループなので、足りない分を追加する
+            groups = groups_by_round[round_number]
+            for id_in_subsession in range(len(groups) + 1, len(players) // size + 1):
+                groups.append(
+                    Group.objects_create(
+                        session=session,
+                        subsession=subsessions[round_number],
+                        round_number=round_number,
+                        id_in_subsession=id_in_subsession,
+                    )
+                )
+            # ラウンドごとにランダムにグループを組み直す
+            random.shuffle(players)
+            for index, p in enumerate(players):
+                p.group = groups[index // size]
+                p.id_in_group = index % size + 1
+
+
+def creating_session(subsession):
+    # game/__init__.py から読み込まれる新形式のアプリでは、oTree はモジュール
+    # レベルの creating_session を呼び出す
+    subsession.creating_session()
+
+
+def group_by_arrival_time_method(subsession, waiting_players):
+    """ArrivalWaitPage で待っている参加者から 1 グループをランダムに選ぶ
+
+    players_per_group 人そろった時点でグループを作る。待っている人数が
+    それより多ければ、initialize_all_rounds と同じくランダムに組み合わせる。
+    """
+    size = treatment_params(subsession.session).players_per_group
+    if len(waiting_players) >= size:
+        return random.sample(waiting_players, size)
+
+
+class GroupContext:
+    """グループのメンバー（と参加者）を一度だけ読み込み、同じリクエスト内で使い回す
+
+    group_context() から取得する。キャッシュは DB セッション (Session.info) に
+    保存されるため、oTree がリクエストごとに作るセッションと共に破棄される。
+    """
+
+    def __init__(self, group, players):
+        self.group = group
+        self.players = sorted(players, key=lambda p: p.id_in_group)
+        self.by_id = {p.id_in_group: p for p in self.players}
+
+    def get_player_by_id(self, id_in_group):
+        return self.by_id[id_in_group]
+
+    def others(self, player):
+        return [p for p in self.players if p.id_in_group != player.id_in_group]
+
+
+def group_context(group):
+    """group の GroupContext（同じ DB セッション内では同じオブジェクトを返す）"""
+    state = sa_inspect(group, raiseerr=False)
+    if state is None or state.session is None:
+        # DB に紐づかないグループ（ベンチマーク用のダミーなど）はその場で作る
+        return GroupContext(group, group.get_players())
+    contexts = state.session.info.setdefault('group_contexts', {})
+    context = contexts.get(group.id)
+    if context is None:
+        players = Player.objects_filter(group=group).options(joinedload(Player.participant))
+        context = contexts[group.id] = GroupContext(group, players)
+    return context
 
 
 class Group(BaseGroup):
     total_contribution = models.CurrencyField()
     individual_share = models.CurrencyField()
+    # ラウンド内のやり取りをまとめた辺のリスト [[与えた人, 受けた人, 値], ...] (JSON)
+    # 人と人は id_in_group で表し、0 の辺は保存しない
+    # punishment_attempted: 入力された罰ポイント
+    # punishment_points: 精算後に実際に使われた罰ポイント
+    # punishment_loss: 精算後に実際に発生した損失
+    # power_transfer: 罰威力の移譲量
+    round_edges = models.LongStringField(initial='', blank=True)
+    # ラウンド確定時に保存する履歴スナップショット (JSON)
+    history_snapshot = models.LongStringField(initial='', blank=True)
+    # 各フェーズで入力を終えた人数（待機ページの進捗表示用）
+    power_transfer_submitted = models.IntegerField(initial=0)
+    contribution_submitted = models.IntegerField(initial=0)
+    punishment_submitted = models.IntegerField(initial=0)
+    # 結果ページ用のグループ共通の表示データ (JSON)。各待機ページで一度だけ作成する
+    # contribution / power_transfer / round / final
+    round_summary = models.LongStringField(initial='', blank=True)
+    # 精算を終えたフェーズ (power_transfer / contribution / payoff) の JSON リスト
+    # 精算の結果と同じコミットで保存するチェックポイント（pages.settle_once）
+    settled_phases = models.LongStringField(initial='', blank=True)
 
     def set_group_contribution(self):
         """グループの総貢献額と各自の取り分を計算"""
-        players = self.get_players()
+        players = group_context(self).players
         contributions = [p.contribution or 0 for p in players]
         self.total_contribution = sum(contributions)
         group_size = len(players) or 1
-        multiplier = self.session.config.get('contribution_multiplier', Constants.multiplier)
-        share_value = float(self.total_contribution) * float(multiplier) / group_size
+        multiplier = treatment_params(self.session).contribution_multiplier
+        share_value = float(self.total_contribution) * multiplier / group_size
         self.individual_share = c(share_value)
 
     def set_payoff(self):
         """懲罰フェーズ終了後に各プレイヤーの利得を確定"""
         self.adjust_punishments()
-        for player in self.get_players():
+        for player in group_context(self).players:
             player.set_payoff()
 
     def adjust_punishments(self):
-        session = self.session
-        players = self.get_players()
-        cost_per_point = session.config.get('punishment_cost', 1)
-        effectiveness_base = session.config.get('power_effectiveness', Constants.power_effectiveness)
-
-        actual_cost = {p: 0.0 for p in players}
-        actual_points_sent = {p: 0.0 for p in players}
-
-        for victim in players:
-            victim_available = float(victim.available_before_punishment or victim.available_endowment or 0)
-            punish_entries = []
-            total_loss = 0.0
-            for punisher in players:
-                if punisher.id_in_group == victim.id_in_group:
-                    continue
-                attempted_points = getattr(punisher, f'punish_p{victim.id_in_group}', 0) or 0
-                if attempted_points <= 0:
-                    continue
-                effective_power = punisher.punishment_power_after or punisher.participant.vars.get('punishment_power', 1.0)
-                loss_per_point = effectiveness_base * effective_power
-                total_loss += attempted_points * loss_per_point
-                punish_entries.append((punisher, attempted_points, loss_per_point))
-
-            if total_loss <= victim_available + 1e-9:
-                scale = 1.0
-            else:
-                if total_loss <= 0 or victim_available <= 0:
-                    scale = 0.0
-                else:
-                    scale = victim_available / total_loss
-
-            actual_loss = 0.0
-            received_points = 0.0
-            for punisher, attempted_points, loss_per_point in punish_entries:
-                points_used = round(attempted_points * scale, 6)
-                loss = points_used * loss_per_point
-                actual_loss += loss
-                received_points += points_used
-
-                actual_points_sent[punisher] += points_used
-                actual_cost[punisher] += points_used * cost_per_point
-
-            victim_available = max(0.0, victim_available - actual_loss)
-            victim.available_endowment = c(victim_available)
-            victim.punishment_points_received_actual = received_points
-            victim.punishment_received = c(actual_loss)
-            if victim_available <= 0:
-                victim.can_receive_punishment = False
-
-        for punisher in players:
-            attempted_cost = float(punisher.attempted_punishment_cost or 0)
-            actual_cost_value = min(actual_cost[punisher], attempted_cost)
-
-            available_before = float(punisher.available_before_punishment or punisher.available_endowment or 0)
-            new_available = max(0.0, available_before - actual_cost_value)
-            punisher.available_endowment = c(new_available)
-            punisher.punishment_given = c(actual_cost_value)
-            punisher.punishment_points_given_actual = actual_points_sent[punisher]
-            if new_available <= 0:
-                punisher.can_receive_punishment = False
+        """罰ポイントを精算し、結果をプレイヤーとグループに保存"""
+        params = treatment_params(self.session)
+        players = group_context(self).players
+        index_of = {p.id_in_group: index for index, p in enumerate(players)}
+
+        attempted = {
+            (index_of[giver.id_in_group], index_of[receiver]): points
+            for giver in players
+            for receiver, points in giver.punishments_sent().items()
+            if receiver in index_of
+        }
+        result = settle_punishments(
+            attempted=attempted,
+            powers=[p.effective_punishment_power() for p in players],
+            available=[
+                float(p.available_before_punishment or p.available_endowment or 0)
+                for p in players
+            ],
+            attempted_costs=[float(p.attempted_punishment_cost or 0) for p in players],
+            effectiveness=params.power_effectiveness,
+            cost_per_point=params.punishment_cost,
+        )
+
+        for index, player in enumerate(players):
+            available_after = result['available_after'][index]
+            player.available_endowment = c(available_after)
+            player.punishment_points_given_actual = result['points_sent'][index]
+            player.punishment_points_received_actual = result['points_received'][index]
+            player.punishment_given = c(result['costs'][index])
+            player.punishment_received = c(result['losses'][index])
+            if available_after <= 0:
+                player.can_receive_punishment = False
+
+        ids = [p.id_in_group for p in players]
+        self.save_edges(
+            **{
+                kind: {(ids[g], ids[v]): value for (g, v), value in edges.items()}
+                for kind, edges in [
+                    ('punishment_attempted', attempted),
+                    ('punishment_points', result['points_used']),
+                    ('punishment_loss', result['loss']),
+                ]
+            }
+        )
+
+    def edges(self, kind):
+        """保存済みの辺 {(与えた人, 受けた人): 値}（未保存の種類は空）"""
+        stored = json.loads(self.round_edges) if self.round_edges else {}
+        return {(giver, receiver): value for giver, receiver, value in stored.get(kind, [])}
+
+    def save_edges(self, **edges):
+        """種類ごとの辺 {(与えた人, 受けた人): 値} を保存（0 の辺は省く）"""
+        stored = json.loads(self.round_edges) if self.round_edges else {}
+        for kind, values in edges.items():
+            stored[kind] = [
+                [giver, receiver, value]
+                for (giver, receiver), value in sorted(values.items())
+                if value
+            ]
+        self.round_edges = json.dumps(stored, separators=(',', ':'))
+
+    def summary(self):
+        """保存済みの結果ページ用データ"""
+        return json.loads(self.round_summary) if self.round_summary else {}
+
+    def save_summary(self, **parts):
+        stored = self.summary()
+        stored.update(parts)
+        self.round_summary = json.dumps(stored, separators=(',', ':'), ensure_ascii=False)
+
+    def is_settled(self, phase):
+        return phase in (json.loads(self.settled_phases) if self.settled_phases else [])
+
+    def mark_settled(self, phase):
+        phases = json.loads(self.settled_phases) if self.settled_phases else []
+        if phase not in phases:
+            phases.append(phase)
+        self.settled_phases = json.dumps(phases)
 
 
 class Player(BasePlayer):
@@ -153,25 +457,18 @@ class Player(BasePlayer):
     def contribution_max(self):
         if self.available_endowment is not None:
             return self.available_endowment
-        return self.session.config['endowment']
+        return treatment_params(self.session).endowment
 
-    # 各プレイヤーに与える罰ポイントを入力するフィールド
-    # グループは最大5人を想定し、id_in_group は 1〜5
-    punish_p1 = models.IntegerField(min=0, initial=0, label="プレイヤー1への罰ポイント")
-    punish_p2 = models.IntegerField(min=0, initial=0, label="プレイヤー2への罰ポイント")
-    punish_p3 = models.IntegerField(min=0, initial=0, label="プレイヤー3への罰ポイント")
-    punish_p4 = models.IntegerField(min=0, initial=0, label="プレイヤー4への罰ポイント")
-    punish_p5 = models.IntegerField(min=0, initial=0, label="プレイヤー5への罰ポイント")
+    # 各プレイヤーに与える罰ポイント {受けた人の id_in_group: ポイント} (JSON)
+    # グループの人数に関わらず 1 列で、0 の相手は保存しない
+    punishments = models.LongStringField(initial='', blank=True, label="罰ポイント")
 
     punishment_given = models.CurrencyField(doc="与えた罰の総コスト")
     punishment_received = models.CurrencyField(doc="受けた罰による総損失")
 
     # 罰威力の移譲に関するフィールド
-    power_transfer_p1 = models.FloatField(min=0, initial=0, blank=True)
-    power_transfer_p2 = models.FloatField(min=0, initial=0, blank=True)
-    power_transfer_p3 = models.FloatField(min=0, initial=0, blank=True)
-    power_transfer_p4 = models.FloatField(min=0, initial=0, blank=True)
-    power_transfer_p5 = models.FloatField(min=0, initial=0, blank=True)
+    # 移譲量 {受けた人の id_in_group: 移譲量} (JSON、0 の相手は保存しない)
+    power_transfers = models.LongStringField(initial='', blank=True, label="罰威力の移譲量")
 
     power_transfer_out_total = models.FloatField(initial=0, blank=True)
     power_transfer_in_total = models.FloatField(initial=0, blank=True)
@@ -187,48 +484,128 @@ class Player(BasePlayer):
     punishment_points_given_actual = models.FloatField(initial=0, blank=True)
     punishment_points_received_actual = models.FloatField(initial=0, blank=True)
 
+    # 時間切れの記録。時間切れのページはサーバー側の既定の行動で進める
+    # （貢献: 前ラウンドの貢献額、移譲: なし、懲罰: なし）
+    previous_contribution = models.CurrencyField(initial=c(0), blank=True, doc="前ラウンドの貢献額")
+    contribution_timed_out = models.BooleanField(initial=False)
+    power_transfer_timed_out = models.BooleanField(initial=False)
+    punishment_timed_out = models.BooleanField(initial=False)
+
+    # 参加者の状態は participant.vars（リクエストのたびに全体を pickle で読み書きする）
+    # ではなく、ラウンドごとの Player のフィールドに持ち、start_round で引き継ぐ
+    cumulative_payoff = models.CurrencyField(initial=c(0), doc="このラウンドまでの累積利得")
+    previous_cumulative_payoff = models.CurrencyField(initial=c(0), doc="前ラウンドまでの累積利得")
+    round_started = models.BooleanField(initial=False)
+
     # payoff フィールドは oTree が自動生成するため、後で値を代入する
 
+    def start_round(self):
+        """このラウンドに到達した時点で、初期状態を本人の前ラウンドの確定結果から設定する
+
+        グループは全ラウンド分をセッション作成時に決めるので、同じグループの他の
+        メンバーはまだ前ラウンドの途中（未精算）のことがある。そのため各自が
+        到達したときに自分の分だけを設定する（2 回目以降は何もしない）。
+        """
+        if self.round_started:
+            return
+        state = initial_player_state(treatment_params(self.session))
+        if self.round_number > 1:
+            # 移譲後の罰威力を次のラウンドへ引き継ぐ
+            previous = self.in_round(self.round_number - 1)
+            power = previous.punishment_power_after
+            state.update(
+                punishment_power_before=power,
+                punishment_power_after=power,
+                previous_contribution=previous.contribution,
+                # set_payoff でこのラウンドの利得を足す
+                previous_cumulative_payoff=previous.cumulative_payoff,
+                cumulative_payoff=previous.cumulative_payoff,
+            )
+        for field_name, value in state.items():
+            setattr(self, field_name, value)
+        self.round_started = True
+
+    def punishments_sent(self):
+        """与えた罰ポイント {受けた人の id_in_group: ポイント}"""
+        return decode_edges(self.punishments)
+
+    def power_transfers_sent(self):
+        """移譲した罰威力 {受けた人の id_in_group: 移譲量}"""
+        return decode_edges(self.power_transfers)
+
+    def effective_punishment_power(self):
+        if self.punishment_power_after is None:
+            return 1.0
+        return self.punishment_power_after
+
+    def previous_groups(self):
+        """前ラウンドまでのこの参加者のグループ（古い順、1 回のクエリで読み込む）"""
+        players = (
+            Player.objects_filter(participant=self.participant)
+            .filter(Player.round_number < self.round_number)
+            .options(joinedload(Player.group))
+            .order_by(Player.round_number)
+        )
+        return [p.group for p in players]
+
     def set_payoff(self):
-        """今ラウンドの最終利得を計算"""
-        # 懲罰に関する計算
-        # 1. 自分が与えた罰点とコストを集計
-        punishment_points_given = self.punishment_points_given_actual
-        if punishment_points_given in (None, 0):
-            punishment_points_given = 0
-            punishment_fields = [self.punish_p1, self.punish_p2, self.punish_p3, self.punish_p4, self.punish_p5]
-            for i in range(len(punishment_fields)):
-                if (i + 1) != self.id_in_group:
-                    punishment_points_given += punishment_fields[i] if punishment_fields[i] is not None else 0
-            self.punishment_points_given_actual = punishment_points_given
-            self.punishment_given = c(punishment_points_given * self.session.config['punishment_cost'])
-
-        # 2. 自分が受けた罰点と損失を集計
-        punishment_points_received = self.punishment_points_received_actual
-        if punishment_points_received in (None, 0):
-            punishment_points_received = 0
-            punishment_loss = 0
-            effectiveness_base = self.session.config.get('power_effectiveness', Constants.power_effectiveness)
-            if self.can_receive_punishment:
-                for other_player in self.get_others_in_group():
-                    field_name = f'punish_p{self.id_in_group}'
-                    points = getattr(other_player, field_name, 0) or 0
-                    punishment_points_received += points
-                    effective_power = other_player.punishment_power_after or other_player.participant.vars.get('punishment_power', 1.0)
-                    punishment_loss += points * effectiveness_base * effective_power
-            self.punishment_points_received_actual = punishment_points_received
-            self.punishment_received = c(punishment_loss)
-
-        # 3. 式に基づいて最終利得を算出
+        """今ラウンドの最終利得を計算
+
+        罰の損失とコストは Group.adjust_punishments で精算済みの値を使う。
+        """
+        # 式に基づいて最終利得を算出
         # π_i = E - c_i + (m/n)Σc_j - pc*Σd_ij - pe*Σd_ji
         payoff_before_punishment = (
-            self.session.config['endowment'] - self.contribution + self.group.individual_share
+            treatment_params(self.session).endowment - self.contribution + self.group.individual_share
         )
         total_costs = self.punishment_given + self.punishment_received + self.power_transfer_cost
-        self.payoff = payoff_before_punishment - total_costs
-        
-        # 累積利得を更新
-        if 'cumulative_payoff' not in self.participant.vars:
-            self.participant.vars['cumulative_payoff'] = c(0)
-        self.participant.vars['cumulative_payoff'] += self.payoff
-        self.participant.vars['punishment_power'] = self.punishment_power_after
+        self.record_payoff(payoff_before_punishment - total_costs)
+        # 加算ではなく前ラウンドの確定値から求めるので、精算を再実行しても二重に数えない
+        self.cumulative_payoff = self.previous_cumulative_payoff + self.payoff
+
+    def record_payoff(self, payoff):
+        """player.payoff = payoff と同じ（participant.payoff にも差分を足す）だが、コミットしない
+
+        oTree の payoff の setter は代入のたびに db.commit() する。精算中に使うと
+        グループの途中でコミットされ、読み込み済みの行がすべて失効して、次のプレイヤーで
+        読み直しと書き込みが繰り返される。書き込みは待機ページのリクエストの最後の
+        1 回のコミットにまとめる。
+
+        oTree 6 の setter (otree/models/player.py) から db.commit() を除いたもので、
+        setter が使う列 _payoff に直接書き込む（requirements.txt で oTree 6 に固定している）。
+        _payoff 列が無い oTree では setter に戻す。AUTO_TABULATE_PAYOFFS = False の
+        プロジェクトでも setter に任せ、oTree と同じエラーにする。
+        """
+        if not otree_settings.AUTO_TABULATE_PAYOFFS or not hasattr(type(self), '_payoff'):
+            self.payoff = payoff
+            return
+        if payoff is None:
+            payoff = 0
+        delta = payoff - self._payoff
+        self._payoff += delta
+        self.participant.payoff += delta
+
+
+class PageProfile(ExtraModel):
+    """ページフック 1 回分の計測値（profile_pages が有効なセッションのみ記録）"""
+    session_code = models.StringField()
+    treatment = models.StringField()
+    app_name = models.StringField()
+    page_name = models.StringField()
+    hook = models.StringField()
+    round_number = models.IntegerField()
+    wall_ms = models.FloatField()
+    queries = models.IntegerField()
+    payload_bytes = models.IntegerField()
+
+
+class AuditViolation(ExtraModel):
+    """精算の不変条件の違反 1 件（game/audit.py が記録する）"""
+    session_code = models.StringField()
+    round_number = models.IntegerField()
+    group_id = models.IntegerField()  # id_in_subsession
+    id_in_group = models.IntegerField()  # グループ全体の違反は 0
+    phase = models.StringField()
+    check = models.StringField()
+    expected = models.StringField()
+    actual = models.StringField()
@@ -1,159 +1,443 @@
 # game/pages.py
 
+import json
+
 from otree.api import Page, WaitPage
 
-from .models import Constants
+from .audit import audit_group
+from .models import Constants, default_contribution, encode_edges, group_context, treatment_params
+from .profiling import instrument_pages
+from .settlement import (
+    available_after_contribution,
+    available_after_transfer,
+    settle_power_transfers,
+    transfer_cost,
+)
 from otree.api import Currency as c # Currency をインポートするための別名
 
 
-def build_history_rounds(player):
-    """Collect per-round history data for templates."""
-    session = player.session
-    endowment = session.config.get('endowment', 0)
-    endowment_currency = c(endowment)
-    rounds = []
-
-    for prev in player.in_previous_rounds():
-        group = prev.group
-        members = group.get_players()
-
-        player_entries = []
-        has_power_transfer = (
-            session.config.get('power_transfer_allowed')
-            and prev.round_number >= 3
+HISTORY_CURRENCY_KEYS = (
+    'contribution',
+    'endowment',
+    'available_endowment',
+    'available_before_contribution',
+    'punishment_received_total',
+    'power_transfer_cost',
+)
+
+
+def waiting_progress(group, counter):
+    """待機ページに表示する進捗（counter は Group の *_submitted フィールド名）"""
+    return dict(type='progress', submitted=getattr(group, counter), total=len(group_context(group).players))
+
+
+# JavaScript が動かず、相手ごとの入力がまとめられないまま送信されたとき
+MISSING_EDGES_ERROR = '入力値が送信されませんでした。ページを再読み込みしてからもう一度入力してください。'
+
+
+def parse_edges(text, receivers, integer=False):
+    """フォームから送られた JSON {受けた人の id_in_group: 値} を読み込む
+
+    receivers に無い相手・負の値・数値でない値は ValueError。0 の相手は省く。
+    """
+    if not text:
+        return {}
+    try:
+        submitted = json.loads(text)
+    except ValueError:
+        raise ValueError('入力値を読み取れませんでした。') from None
+    if not isinstance(submitted, dict):
+        raise ValueError('入力値を読み取れませんでした。')
+    edges = {}
+    for receiver, value in submitted.items():
+        try:
+            receiver = int(receiver)
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError('数値を入力してください。') from None
+        if receiver not in receivers:
+            raise ValueError(f'プレイヤー {receiver} には入力できません。')
+        if value < 0:
+            raise ValueError('0以上の値を入力してください。')
+        if integer:
+            if not value.is_integer():
+                raise ValueError('整数で入力してください。')
+            value = int(value)
+        if value:
+            edges[receiver] = value
+    return edges
+
+
+def punishable_ids(player):
+    """罰を与えられる相手（罰を受けられる相手）の id_in_group"""
+    return [
+        other.id_in_group
+        for other in group_context(player.group).others(player)
+        if other.can_receive_punishment
+    ]
+
+
+def build_round_snapshot(group):
+    """Build the JSON-serializable history entry of a settled round."""
+    params = treatment_params(group.session)
+    endowment = float(params.endowment)
+    members = group_context(group).players
+    round_number = group.round_number
+
+    player_entries = []
+    has_power_transfer = params.has_power_transfer(round_number)
+
+    for member in members:
+        player_entries.append(
+            dict(
+                id_in_group=member.id_in_group,
+                contribution=float(member.contribution or 0),
+                endowment=endowment,
+                available_endowment=float(member.available_endowment or 0),
+                available_before_contribution=float(
+                    member.available_before_contribution
+                    or (member.available_endowment or 0) + (member.contribution or 0)
+                ),
+                punishment_sent_total=member.punishment_points_given_actual,
+                punishment_received_total=float(member.punishment_received or 0),
+                power_before=member.punishment_power_before,
+                power_after=member.punishment_power_after,
+                power_after_display=f"{member.punishment_power_after:.1f}",
+                power_transfer_out=member.power_transfer_out_total,
+                power_transfer_out_display=f"{member.power_transfer_out_total:.1f}",
+                power_transfer_in=member.power_transfer_in_total,
+                power_transfer_in_display=f"{member.power_transfer_in_total:.1f}",
+                power_transfer_cost=float(member.power_transfer_cost or 0),
+            )
         )
 
-        for member in members:
-            total_sent = 0
-            for other in members:
-                if other.id_in_group == member.id_in_group:
-                    continue
-                field_name = f'punish_p{other.id_in_group}'
-                total_sent += getattr(member, field_name, 0) or 0
-
-            effective_sent_points = getattr(member, 'punishment_points_given_actual', None)
-            if effective_sent_points is None:
-                effective_sent_points = total_sent
-
-            player_entries.append(
-                dict(
-                    id_in_group=member.id_in_group,
-                    contribution=member.contribution,
-                    endowment=endowment_currency,
-                    available_endowment=member.available_endowment,
-                    punishment_sent_total=effective_sent_points,
-                    punishment_received_total=member.punishment_received,
-                    power_before=member.punishment_power_before,
-                    power_after=member.punishment_power_after,
-                    power_after_display=f"{member.punishment_power_after:.1f}",
-                    power_transfer_out=member.power_transfer_out_total,
-                    power_transfer_out_display=f"{member.power_transfer_out_total:.1f}",
-                    power_transfer_in=member.power_transfer_in_total,
-                    power_transfer_in_display=f"{member.power_transfer_in_total:.1f}",
-                    power_transfer_cost=member.power_transfer_cost,
+    # 表示用の表は人数 × 人数になるが、値は保存済みの辺から引く
+    loss = group.edges('punishment_loss')
+    matrix_rows = []
+    for victim in members:
+        cells = []
+        for giver in members:
+            if giver.id_in_group == victim.id_in_group:
+                cells.append(dict(is_self=True, amount=None))
+            else:
+                amount = loss.get((giver.id_in_group, victim.id_in_group), 0.0)
+                cells.append(dict(is_self=False, amount=amount))
+        matrix_rows.append(dict(victim_id=victim.id_in_group, cells=cells))
+
+    transfer_rows = []
+    if has_power_transfer:
+        transfers = group.edges('power_transfer')
+        for giver in members:
+            cells = []
+            for receiver in members:
+                is_self = giver.id_in_group == receiver.id_in_group
+                amount = None if is_self else transfers.get((giver.id_in_group, receiver.id_in_group), 0)
+                cells.append(
+                    dict(
+                        is_self=is_self,
+                        amount=amount,
+                        amount_display=(f"{amount:.1f}" if amount is not None else None),
+                    )
                 )
+            transfer_rows.append(dict(giver_id=giver.id_in_group, cells=cells))
+
+    return dict(
+        round_number=round_number,
+        players=player_entries,
+        matrix_rows=matrix_rows,
+        transfer_rows=transfer_rows,
+        has_punishment=round_number > 1,
+        has_power_transfer=has_power_transfer,
+    )
+
+
+def store_round_history(group):
+    """ラウンド確定時に履歴スナップショットをグループに保存
+
+    結果ページ (RoundResult) 用の表示データも同じスナップショットから作成する。
+    """
+    snapshot = build_round_snapshot(group)
+    group.save_summary(round=present_history_round(snapshot))
+    group.history_snapshot = json.dumps(snapshot)
+
+
+def build_contribution_summary(group):
+    """ContributionResult のグループ共通データ"""
+    share = group.individual_share
+    rows = []
+    for member in group_context(group).players:
+        contribution = member.contribution
+        remaining = member.available_endowment or c(0)
+        available_before = member.available_before_contribution or remaining + contribution
+        rows.append(
+            dict(
+                id_in_group=member.id_in_group,
+                contribution=str(contribution),
+                received_from_public=str(share),
+                current_total=str(remaining + share),
+                available_before_contribution=str(available_before),
             )
+        )
+    return dict(total_contribution=str(group.total_contribution), share=str(share), rows=rows)
+
+
+def build_power_transfer_summary(group):
+    """PowerTransferResult のグループ共通データ（行列は [与えた人][受けた人]）"""
+    members = group_context(group).players
+    columns = [
+        dict(
+            id_in_group=member.id_in_group,
+            header=f"プレイヤー {member.id_in_group}",
+            final_power_display=f"{member.punishment_power_after:.1f} / 1.0",
+            net_transfer_display=f"- {member.power_transfer_out_total:.1f} / + {member.power_transfer_in_total:.1f}",
+            transfer_cost_display=f"{float(member.power_transfer_cost or 0):.1f}",
+        )
+        for member in members
+    ]
+    transfers = group.edges('power_transfer')
+    matrix = [
+        [
+            None if giver is receiver
+            else f"{transfers.get((giver.id_in_group, receiver.id_in_group), 0):.1f}"
+            for receiver in members
+        ]
+        for giver in members
+    ]
+    return dict(columns=columns, matrix=matrix)
+
+
+def build_final_summary(group):
+    """FinalResult に表示する各メンバーの累積利得"""
+    return [
+        dict(id_in_group=member.id_in_group, payoff=str(member.participant.payoff))
+        for member in group_context(group).players
+    ]
+
+
+def settle_once(group, phase, settle):
+    """group の phase の精算 settle(group) を 1 回だけ行う（精算済みなら何もしない）
+
+    チェックポイント (Group.settled_phases) は精算の結果と同じ待機ページの
+    リクエストでコミットされる。途中で落ちたリクエストは何も残さないので、
+    再起動後に待機ページを開き直せばそのグループの精算だけがやり直される。
+    同じ精算がもう一度呼ばれても（再送や同時に到着した最後の 2 人）、
+    利得や累積利得を二重に数えない。
+    """
+    if group.is_settled(phase):
+        return
+    settle(group)
+    group.mark_settled(phase)
+
+
+def settle_power_transfer_phase(group):
+    """罰威力の移譲を精算し、移譲コストを差し引いた保有額を設定する"""
+    params = treatment_params(group.session)
+    players = group_context(group).players
+    index_of = {player.id_in_group: index for index, player in enumerate(players)}
+    transfers = {}
+    for giver in players:
+        for receiver, amount in giver.power_transfers_sent().items():
+            if receiver in index_of and receiver != giver.id_in_group:
+                transfers[(giver.id_in_group, receiver)] = amount
+    group.save_edges(power_transfer=transfers)
+    result = settle_power_transfers(
+        {(index_of[g], index_of[r]): amount for (g, r), amount in transfers.items()},
+        powers_before=[player.punishment_power_before for player in players],
+        out_totals=[player.power_transfer_out_total for player in players],
+    )
+
+    for index, player in enumerate(players):
+        player.power_transfer_in_total = result['in_totals'][index]
+        player.punishment_power_after = result['powers_after'][index]
+
+        remaining, player.can_receive_punishment = available_after_transfer(
+            params.endowment,
+            float(player.power_transfer_cost or 0),
+            costly=params.costly_punishment_transfer,
+        )
+        player.available_endowment = c(remaining)
+    audit_group(group, 'power_transfer')
+    group.save_summary(power_transfer=build_power_transfer_summary(group))
 
-        effectiveness_base = session.config.get('power_effectiveness', Constants.power_effectiveness)
-        matrix_rows = []
-        for victim in members:
-            actual_loss = float(victim.punishment_received or 0)
-            if actual_loss <= 0:
-                victim_before = float(victim.available_before_punishment or victim.available_endowment or 0)
-                victim_after = float(victim.available_endowment or 0)
-                diff = victim_before - victim_after
-                if diff > actual_loss:
-                    actual_loss = max(0.0, diff)
-
-            attempted_loss = 0.0
-            attempted_points = {}
-            effective_power_map = {}
-            for giver in members:
-                if giver.id_in_group == victim.id_in_group:
-                    continue
-                points = getattr(giver, f'punish_p{victim.id_in_group}', 0) or 0
-                attempted_points[giver.id_in_group] = points
-                effective_power = (
-                    giver.punishment_power_after
-                    or giver.participant.vars.get('punishment_power', 1.0)
-                )
-                effective_power_map[giver.id_in_group] = effective_power
-                if points > 0:
-                    attempted_loss += points * effectiveness_base * effective_power
 
-            if attempted_loss <= 0:
-                scale = 0.0
-            else:
-                scale = min(1.0, actual_loss / attempted_loss)
+def settle_contribution_phase(group):
+    """総貢献額と取り分を計算する"""
+    group.set_group_contribution()
+    audit_group(group, 'contribution')
+    group.save_summary(contribution=build_contribution_summary(group))
 
-            cells = []
-            total_received = 0.0
-            for giver in members:
-                is_self = giver.id_in_group == victim.id_in_group
-                if is_self:
-                    cells.append(dict(is_self=True, amount=None, amount_display=None))
-                else:
-                    points_attempted = attempted_points.get(giver.id_in_group, 0)
-                    points_used = round(points_attempted * scale, 6)
-                    effective_power = effective_power_map.get(
-                        giver.id_in_group,
-                        giver.punishment_power_after
-                        or giver.participant.vars.get('punishment_power', 1.0),
-                    )
-                    actual_loss_value = points_used * effectiveness_base * effective_power
-                    total_received += actual_loss_value
-                    loss_display = c(actual_loss_value)
-                    cells.append(
-                        dict(
-                            is_self=False,
-                            amount=loss_display,
-                            amount_display=loss_display,
-                        )
-                    )
 
-            if victim.punishment_received is not None:
-                summary_loss = victim.punishment_received
-            else:
-                summary_loss = c(total_received)
-
-            for entry in player_entries:
-                if entry['id_in_group'] == victim.id_in_group:
-                    entry['punishment_received_total'] = summary_loss
-                    break
-
-            matrix_rows.append(dict(victim_id=victim.id_in_group, cells=cells))
-
-        transfer_rows = []
-        if has_power_transfer:
-            for giver in members:
-                cells = []
-                for receiver in members:
-                    is_self = giver.id_in_group == receiver.id_in_group
-                    amount = None
-                    if not is_self:
-                        field_name = f'power_transfer_p{receiver.id_in_group}'
-                        amount = getattr(giver, field_name, 0) or 0
-                    cells.append(
-                        dict(
-                            is_self=is_self,
-                            amount=amount,
-                            amount_display=(f"{amount:.1f}" if amount is not None else None),
-                        )
-                    )
-                transfer_rows.append(dict(giver_id=giver.id_in_group, cells=cells))
+def settle_payoff_phase(group):
+    """罰を精算して利得を確定し、ラウンドの履歴を保存する"""
+    group.set_payoff()
+    store_round_history(group)
+    audit_group(group, 'payoff')
+    if group.round_number == Constants.num_rounds:
+        group.save_summary(final=build_final_summary(group))
 
-        rounds.append(
-            dict(
-                round_number=prev.round_number,
-                players=player_entries,
-                matrix_rows=matrix_rows,
-                transfer_rows=transfer_rows,
-                has_punishment=prev.round_number > 1,
-                has_power_transfer=has_power_transfer,
+
+HISTORY_PAGE_SIZE = 5  # 履歴モーダルの 1 ページに表示するラウンド数
+
+
+def present_history_round(snapshot):
+    """Convert a stored snapshot into the compact values sent to the history modal."""
+    players = []
+    for entry in snapshot['players']:
+        entry = dict(entry)
+        for key in HISTORY_CURRENCY_KEYS:
+            entry[key] = str(c(entry[key]))
+        players.append(entry)
+
+    matrix_rows = []
+    for row in snapshot['matrix_rows']:
+        cells = [
+            None if cell['is_self'] else str(c(cell['amount']))
+            for cell in row['cells']
+        ]
+        matrix_rows.append(dict(victim_id=row['victim_id'], cells=cells))
+
+    transfer_rows = []
+    for row in snapshot['transfer_rows']:
+        cells = [None if cell['is_self'] else cell['amount_display'] for cell in row['cells']]
+        transfer_rows.append(dict(giver_id=row['giver_id'], cells=cells))
+
+    return dict(
+        snapshot,
+        players=players,
+        matrix_rows=matrix_rows,
+        transfer_rows=transfer_rows,
+    )
+
+
+def load_history_round(group):
+    """group に保存済みのスナップショット（保存されていなければ再構築）"""
+    stored = group.history_snapshot
+    return json.loads(stored) if stored else build_round_snapshot(group)
+
+
+def build_history_rounds(player):
+    """Collect the stored snapshots of all settled rounds, oldest first.
+
+    スナップショットは過去のグループに保存済み（履歴モーダルを開いたときだけ
+    1 回のクエリで読み込む）。
+    """
+    return [load_history_round(group) for group in player.previous_groups()]
+
+
+def history_page(player, page=None):
+    """履歴モーダルの 1 ページ分（page を省略すると最新のページ、範囲外は端のページ）"""
+    rounds = player.previous_groups()
+    num_pages = max(1, -(-len(rounds) // HISTORY_PAGE_SIZE))
+    if page is None:
+        page = num_pages - 1
+    page = min(max(page, 0), num_pages - 1)
+    # 最新のページが常に直近 HISTORY_PAGE_SIZE ラウンドになるよう末尾から区切る
+    end = len(rounds) - (num_pages - 1 - page) * HISTORY_PAGE_SIZE
+    start = max(0, end - HISTORY_PAGE_SIZE)
+    return dict(
+        type='history',
+        page=page,
+        num_pages=num_pages,
+        rounds=[present_history_round(load_history_round(group)) for group in rounds[start:end]],
+    )
+
+
+def history_live_method(player, data):
+    """履歴モーダルからの要求に、要求した本人にだけ返信する"""
+    if data.get('type') == 'history':
+        page = data.get('page')
+        # JSON の true / false は Python では int の一種なので、ページ番号として受け付けない
+        if not isinstance(page, int) or isinstance(page, bool):
+            page = None
+        return {player.id_in_group: history_page(player, page)}
+
+
+def form_live_method(player, data, check):
+    """入力中の値の検証 (type='validate') と履歴モーダルの要求に、本人にだけ返信する
+
+    value はフォームで送信するのと同じ値。check は error_message と同じ検証関数で、
+    ページ全体を送信・再描画せずに同じエラーメッセージ（無ければ None）を返す。
+    seq はブラウザ側で古い応答を捨てるためにそのまま返す。
+    """
+    if data.get('type') == 'validate':
+        return {
+            player.id_in_group: dict(
+                type='validation', seq=data.get('seq'), error=check(player, data.get('value'))
             )
-        )
+        }
+    return history_live_method(player, data)
+
+
+def contribution_error(player, contribution):
+    """貢献額の検証（問題が無ければ None）"""
+    if contribution is None or contribution == '':
+        return '貢献額を入力してください。'
+    try:
+        amount = float(contribution)
+    except (TypeError, ValueError):
+        return '貢献額を入力してください。'
+    endowment = treatment_params(player.session).endowment
+    available = float(
+        player.available_endowment if player.available_endowment is not None else endowment
+    )
+    if amount < 0 or amount > available:
+        limit = int(available)
+        return f'貢献額は0から{limit}までの範囲で入力してください。'
+    if not amount.is_integer():
+        return '貢献額は整数で入力してください。'
+    return None
+
+
+def power_transfer_error(player, text):
+    """罰威力の移譲量 (JSON) の検証（問題が無ければ None）"""
+    transfer_unit = treatment_params(player.session).punishment_transfer_unit
+    tolerance = 1e-6
+    others = {other.id_in_group for other in group_context(player.group).others(player)}
+    if not text and others:
+        # 入力欄の値は game.js がまとめる。空のまま届いたら「移譲なし」とはみなさない
+        return MISSING_EDGES_ERROR
+    try:
+        transfers = parse_edges(text, others)
+    except ValueError as e:
+        return f"譲渡量: {e}"
+    total = 0
+    for value in transfers.values():
+        total += value
+        if transfer_unit > 0:
+            multiples = value / transfer_unit
+            if abs(multiples - round(multiples)) > 1e-6:
+                return f"譲渡量は {transfer_unit} の倍数で入力してください。"
+
+    if total - player.punishment_power_before > tolerance:
+        return "譲渡量の合計が保有する罰威力を超えています。"
+    return None
+
+
+def punishment_error(player, text):
+    """罰ポイント (JSON) の検証（問題が無ければ None）"""
+    targets = set(punishable_ids(player))
+    if not text and targets:
+        return MISSING_EDGES_ERROR
+    try:
+        punishments = parse_edges(text, targets, integer=True)
+    except ValueError as e:
+        return f"罰ポイント: {e}"
+    total_punishment = sum(punishments.values())
+
+    params = treatment_params(player.session)
+    if total_punishment > params.deduction_points:
+        return f"送られた点数 {params.deduction_points}　を越えてはいけません。"
+    punishment_cost = params.punishment_cost
+    total_cost = total_punishment * punishment_cost
+    available = float(player.available_endowment or 0)
+    if total_cost > available + 1e-6:
+        if punishment_cost > 0:
+            max_points = int(available // punishment_cost)
+        else:
+            max_points = total_punishment
+        return f"現在、使えるMUsは {max_points} です。もう一度試して下さい。"
+    return None
 
-    return rounds
 
 # =============================================================================
 # CLASS: Contribution
@@ -164,44 +448,39 @@ class Contribution(Page):
 
     @staticmethod
     def vars_for_template(player):
-        # _HistoryModal.html の player.in_all_rounds イテレータが正しい id_range を得られるようにする
-        id_range = list(range(1, Constants.players_per_group + 1))
         return dict(
-            history=player.in_previous_rounds(),
-            id_range=id_range,
             C=Constants,
-            history_rounds=build_history_rounds(player),
+            has_history=player.round_number > 1,
             available_endowment=player.available_endowment,
         )
 
+    @staticmethod
+    def get_timeout_seconds(player):
+        return treatment_params(player.session).timeout_seconds('contribution')
+
+    @staticmethod
+    def live_method(player, data):
+        return form_live_method(player, data, contribution_error)
+
     @staticmethod
     def error_message(player, values):
-        contribution = values.get('contribution')
-        if contribution is None:
-            return '貢献額を入力してください。'
-        endowment = player.session.config.get('endowment', Constants.endowment)
-        amount = float(contribution)
-        available = float(player.available_endowment or endowment)
-        if amount < 0 or amount > available:
-            limit = int(available)
-            return f'貢献額は0から{limit}までの範囲で入力してください。'
-        if not amount.is_integer():
-            return '貢献額は整数で入力してください。'
-        return None
+        return contribution_error(player, values.get('contribution'))
 
     @staticmethod
     def before_next_page(player, timeout_happened):
-        endowment = player.session.config.get('endowment', Constants.endowment)
+        if timeout_happened:
+            # 時間切れ: 入力途中の値は使わず、前ラウンドの貢献額にする
+            player.contribution_timed_out = True
+            player.contribution = c(default_contribution(player))
+        endowment = treatment_params(player.session).endowment
         available = player.available_endowment if player.available_endowment is not None else c(endowment)
         player.available_before_contribution = available
-        remaining = available - player.contribution
-        if remaining < c(0):
-            remaining = c(0)
-        player.available_endowment = remaining
-        player.available_before_punishment = remaining
-        if remaining <= c(0):
-            player.can_receive_punishment = False
-        player.participant.vars['contribution_submitted_round'] = player.round_number
+        remaining, player.can_receive_punishment = available_after_contribution(
+            available, player.contribution, player.can_receive_punishment
+        )
+        player.available_endowment = c(remaining)
+        player.available_before_punishment = c(remaining)
+        player.group.contribution_submitted += 1
 
 # =============================================================================
 # CLASS: ContributionWaitPage
@@ -211,22 +490,20 @@ class ContributionWaitPage(WaitPage):
 
     @staticmethod
     def after_all_players_arrive(group):
-        group.set_group_contribution()
+        settle_once(group, 'contribution', settle_contribution_phase)
         if group.round_number == 1:
-            for player in group.get_players():
-                player.set_payoff()
+            # 第1ラウンドは懲罰が無いので、ここで利得を確定する
+            settle_once(group, 'payoff', settle_payoff_phase)
 
     @staticmethod
     def vars_for_template(player):
-        players = player.group.get_players()
-        current_round = player.round_number
-        submitted = sum(
-            1
-            for p in players
-            if p.participant.vars.get('contribution_submitted_round') == current_round
-        )
-        total = len(players)
-        return dict(waiting_progress=submitted, waiting_total=total)
+        progress = waiting_progress(player.group, 'contribution_submitted')
+        return dict(waiting_progress=progress['submitted'], waiting_total=progress['total'])
+
+    @staticmethod
+    def live_method(player, data):
+        # 待機ページを開いた参加者から届き、グループ全員の表示を更新する
+        return {0: waiting_progress(player.group, 'contribution_submitted')}
 
 # =============================================================================
 # CLASS: ContributionResult
@@ -234,61 +511,73 @@ class ContributionWaitPage(WaitPage):
 class ContributionResult(Page):
     @staticmethod
     def vars_for_template(player):
-        session = player.session
-        endowment = session.config['endowment']
-        endowment_currency = c(endowment)
-        share = player.group.individual_share
-
-        players_data = []
-        for member in player.group.get_players():
-            contribution = member.contribution
-            received_from_public = share
-            remaining = member.available_endowment or c(0)
-            available_before = member.available_before_contribution or remaining + contribution
-            kept_amount = remaining
-            current_total = kept_amount + share
-
-            players_data.append(
-                dict(
-                    player=member,
-                    contribution=contribution,
-                    received_from_public=received_from_public,
-                    current_total=current_total,
-                    available_endowment=remaining,
-                    available_before_contribution=available_before,
-                )
-            )
-
+        group = player.group
+        summary = group.summary().get('contribution') or build_contribution_summary(group)
         return dict(
-            players_data=players_data,
-            endowment=endowment_currency,
-            share=share,
+            players_data=[
+                dict(row, is_self=row['id_in_group'] == player.id_in_group)
+                for row in summary['rows']
+            ],
+            total_contribution=summary['total_contribution'],
+            share=summary['share'],
         )
 
 
+class ArrivalWaitPage(WaitPage):
+    """group_by_arrival_time のセッションで、到着順に players_per_group 人のグループを作る
+
+    グループは models.group_by_arrival_time_method でラウンドごとに組み直す。
+    そろったグループから次のページへ進むので、遅い参加者や欠席者を待たない。
+    到着順のモードでなくても各ラウンドの先頭にあり、本人のラウンドの初期状態を
+    用意する (is_displayed)。
+    """
+
+    template_name = "game/ArrivalWait.html"
+    # oTree はセッションの設定に関係なく、page_sequence の先頭のこの属性を見て
+    # アプリ全体を到着順モードとして作る（全員を 1 グループにする。Constants.
+    # players_per_group = None でも同じ）。到着順でないセッションでは
+    # initialize_all_rounds (assign_random_groups) が players_per_group 人ずつに
+    # 分け直し、このページは is_displayed が False なので到着順の組み直しは起きない。
+    # tests.py と tools/run_bots.py がグループの人数を確認している
+    group_by_arrival_time = True
+
+    @staticmethod
+    def is_displayed(player):
+        # oTree にはプレイヤーがラウンドに入ったときのフックが無い。このページは
+        # page_sequence の先頭で、表示しないセッションでも oTree はページを進める
+        # たびに is_displayed を評価するので、全員・全ラウンドで最初に呼ばれる。
+        # そこで本人のラウンドの初期状態をここで用意する（前ラウンドの最後の
+        # ページはラウンドによって異なり、第1ラウンドには前のページが無い）。
+        # is_displayed は複数回呼ばれうるが、start_round は 2 回目以降何もしない
+        player.start_round()
+        return treatment_params(player.session).group_by_arrival_time
+
+    @staticmethod
+    def vars_for_template(player):
+        return dict(players_per_group=treatment_params(player.session).players_per_group)
+
+
 class PowerTransfer(Page):
     form_model = "player"
 
     @staticmethod
     def is_displayed(player):
-        session = player.session
-        return session.config.get("power_transfer_allowed") and player.round_number >= 3
+        return treatment_params(player.session).has_power_transfer(player.round_number)
+
+    form_fields = ["power_transfers"]
 
     @staticmethod
-    def get_form_fields(player):
-        return [
-            f"power_transfer_p{i}"
-            for i in range(1, Constants.players_per_group + 1)
-            if i != player.id_in_group
-        ]
+    def get_timeout_seconds(player):
+        return treatment_params(player.session).timeout_seconds('power_transfer')
 
     @staticmethod
     def vars_for_template(player):
         session = player.session
-        transfer_unit = session.config.get("punishment_transfer_unit", 0.1)
-        cost_per_unit = session.config.get("power_transfer_cost_rate", 0)
+        params = treatment_params(session)
+        transfer_unit = params.punishment_transfer_unit
+        cost_per_unit = params.power_transfer_cost_rate
         others_data = []
-        for other in player.get_others_in_group():
+        for other in group_context(player.group).others(player):
             others_data.append(
                 dict(
                     id_in_group=other.id_in_group,
@@ -298,7 +587,7 @@ class PowerTransfer(Page):
                 )
             )
 
-        is_costly = session.config.get("costly_punishment_transfer", False)
+        is_costly = params.costly_punishment_transfer
 
         return dict(
             current_power=player.punishment_power_before,
@@ -316,52 +605,41 @@ class PowerTransfer(Page):
             players_status=[],
         )
 
+    @staticmethod
+    def live_method(player, data):
+        return form_live_method(player, data, power_transfer_error)
+
     @staticmethod
     def error_message(player, values):
-        transfer_unit = player.session.config.get("punishment_transfer_unit", 0.1)
-        tolerance = 1e-6
-        total = 0
-        for value in values.values():
-            if value is None:
-                continue
-            if value < -tolerance:
-                return "譲渡量は0以上で入力してください。"
-            total += value
-            if transfer_unit > 0:
-                multiples = value / transfer_unit
-                if abs(multiples - round(multiples)) > 1e-6:
-                    return f"譲渡量は {transfer_unit} の倍数で入力してください。"
-
-        if total - player.punishment_power_before > tolerance:
-            return "譲渡量の合計が保有する罰威力を超えています。"
+        return power_transfer_error(player, values.get("power_transfers"))
 
     @staticmethod
     def before_next_page(player, timeout_happened):
-        session = player.session
-        transfer_fields = [
-            f"power_transfer_p{i}"
-            for i in range(1, Constants.players_per_group + 1)
-            if i != player.id_in_group
-        ]
-        total_out = 0
-        for field in transfer_fields:
-            total_out += getattr(player, field, 0) or 0
+        if timeout_happened:
+            # 時間切れ: 移譲しない
+            player.power_transfer_timed_out = True
+            player.power_transfers = ''
+        params = treatment_params(player.session)
+        others = {other.id_in_group for other in group_context(player.group).others(player)}
+        transfers = parse_edges(player.power_transfers, others)
+        player.power_transfers = encode_edges(transfers)
+        total_out = sum(transfers.values())
         player.power_transfer_out_total = round(total_out, 3)
 
-        unit = session.config.get("punishment_transfer_unit", 0.1)
-        rate = session.config.get("power_transfer_cost_rate", 0)
-        if session.config.get("costly_punishment_transfer") and unit > 0:
-            units = total_out / unit
-            cost_value = units * rate
-            player.power_transfer_cost = c(cost_value)
-        else:
-            player.power_transfer_cost = c(0)
+        player.power_transfer_cost = c(
+            transfer_cost(
+                total_out,
+                unit=params.punishment_transfer_unit,
+                rate=params.power_transfer_cost_rate,
+                costly=params.costly_punishment_transfer,
+            )
+        )
 
         player.punishment_power_after = max(
             0,
             player.punishment_power_before - player.power_transfer_out_total,
         )
-        player.participant.vars['power_transfer_submitted_round'] = player.round_number
+        player.group.power_transfer_submitted += 1
 
 
 class PowerTransferWait(WaitPage):
@@ -369,123 +647,50 @@ class PowerTransferWait(WaitPage):
 
     @staticmethod
     def is_displayed(player):
-        session = player.session
-        return session.config.get("power_transfer_allowed") and player.round_number >= 3
+        return treatment_params(player.session).has_power_transfer(player.round_number)
 
     @staticmethod
     def after_all_players_arrive(group):
-        players = group.get_players()
-        for player in players:
-            total_in = 0
-            for other in players:
-                if other.id_in_group == player.id_in_group:
-                    continue
-                field_name = f"power_transfer_p{player.id_in_group}"
-                total_in += getattr(other, field_name, 0) or 0
-            player.power_transfer_in_total = round(total_in, 3)
-            player.punishment_power_after = max(
-                0,
-                round(
-                    player.punishment_power_before
-                    - player.power_transfer_out_total
-                    + player.power_transfer_in_total,
-                    3,
-                ),
-            )
-            player.participant.vars["punishment_power"] = player.punishment_power_after
-
-            # Carry over the updated punishment power to the next round so that
-            # the transfer results persist. creating_session runs before the
-            # experiment starts, meaning the defaults written there (1.0) need
-            # to be replaced once we know the actual outcome of this round.
-            if player.round_number < Constants.num_rounds:
-                next_player = player.in_round(player.round_number + 1)
-                next_player.punishment_power_before = player.punishment_power_after
-                next_player.punishment_power_after = player.punishment_power_after
-                next_player.participant.vars["punishment_power"] = player.punishment_power_after
-
-            endowment = player.session.config.get('endowment', Constants.endowment)
-            cost_value = float(player.power_transfer_cost or 0)
-            remaining = max(0, endowment - cost_value)
-            player.available_endowment = c(remaining)
-
-            if player.session.config.get('costly_punishment_transfer') and cost_value > 0:
-                player.can_receive_punishment = False
-            else:
-                player.can_receive_punishment = True
+        settle_once(group, 'power_transfer', settle_power_transfer_phase)
 
     @staticmethod
     def vars_for_template(player):
-        players = player.group.get_players()
-        current_round = player.round_number
-        submitted = sum(
-            1
-            for p in players
-            if p.participant.vars.get('power_transfer_submitted_round') == current_round
-        )
-        total = len(players)
-        return dict(waiting_progress=submitted, waiting_total=total)
+        progress = waiting_progress(player.group, 'power_transfer_submitted')
+        return dict(waiting_progress=progress['submitted'], waiting_total=progress['total'])
+
+    @staticmethod
+    def live_method(player, data):
+        # 待機ページを開いた参加者から届き、グループ全員の表示を更新する
+        return {0: waiting_progress(player.group, 'power_transfer_submitted')}
 
 
 class PowerTransferResult(Page):
     @staticmethod
     def is_displayed(player):
-        session = player.session
-        return session.config.get("power_transfer_allowed") and player.round_number >= 3
+        return treatment_params(player.session).has_power_transfer(player.round_number)
 
     @staticmethod
     def vars_for_template(player):
-        session = player.session
-        group_players = sorted(
-            player.group.get_players(), key=lambda p: p.id_in_group
-        )
-
-        columns = []
-        for member in group_players:
-            transfer_cost_value = member.power_transfer_cost
-            if transfer_cost_value is None:
-                transfer_cost_display = "0.0"
-            else:
-                transfer_cost_display = f"{float(transfer_cost_value):.1f}"
-            columns.append(
-                dict(
-                    id_in_group=member.id_in_group,
-                    is_self=member.id_in_group == player.id_in_group,
-                    header=f"プレイヤー {member.id_in_group}",
-                    final_power_display=f"{member.punishment_power_after:.1f} / 1.0",
-                    net_transfer_display=f"- {member.power_transfer_out_total:.1f} / + {member.power_transfer_in_total:.1f}",
-                    transfer_cost_display=transfer_cost_display,
-                    current_balance_display="-",
-                )
-            )
+        group = player.group
+        summary = group.summary().get('power_transfer') or build_power_transfer_summary(group)
+        me = player.id_in_group
 
-        transfer_matrix = []
-        for giver in group_players:
-            row_cells = []
-            for receiver in group_players:
-                if giver.id_in_group == receiver.id_in_group:
-                    row_cells.append(dict(is_self=True, highlight=False, display="-"))
-                else:
-                    field_name = f"power_transfer_p{receiver.id_in_group}"
-                    amount = getattr(giver, field_name, 0) or 0
-                    row_cells.append(
-                        dict(
-                            is_self=False,
-                            highlight=receiver.id_in_group == player.id_in_group,
-                            display=f"{amount:.1f}",
-                        )
-                    )
-            transfer_matrix.append(
-                dict(
-                    row_label=f"プレイヤー {giver.id_in_group}",
-                    is_self=giver.id_in_group == player.id_in_group,
-                    cells=row_cells,
-                )
+        columns = [dict(col, is_self=col['id_in_group'] == me) for col in summary['columns']]
+        ids = [col['id_in_group'] for col in columns]
+        transfer_matrix = [
+            dict(
+                row_label=f"プレイヤー {giver_id}",
+                is_self=giver_id == me,
+                cells=[
+                    dict(is_self=display is None, highlight=receiver_id == me, display=display)
+                    for receiver_id, display in zip(ids, row)
+                ],
             )
-
+            for giver_id, row in zip(ids, summary['matrix'])
+        ]
         headers = [
-            "あなたへの転移" if p.id_in_group == player.id_in_group else f"プレイヤー {p.id_in_group} への転移"
-            for p in group_players
+            "あなたへの転移" if i == me else f"プレイヤー {i} への転移"
+            for i in ids
         ]
         columns_length = len(columns)
 
@@ -496,7 +701,7 @@ class PowerTransferResult(Page):
             transfer_matrix=transfer_matrix,
             transfer_headers=headers,
             round_number=player.round_number,
-            is_costly=session.config.get("costly_punishment_transfer", False),
+            is_costly=treatment_params(player.session).costly_punishment_transfer,
         )
 
 
@@ -507,73 +712,56 @@ class PowerTransferResult(Page):
 class Punishment(Page):
     form_model = 'player'
 
-    @staticmethod
-    def get_form_fields(player):
-        fields = []
-        group = player.group
-        for i in range(1, Constants.players_per_group + 1):
-            if i == player.id_in_group:
-                continue
-            target = group.get_player_by_id(i)
-            if target.can_receive_punishment:
-                fields.append(f'punish_p{i}')
-        return fields
+    form_fields = ['punishments']
 
     @staticmethod
     def is_displayed(player):
         return player.round_number > 1
 
+    @staticmethod
+    def get_timeout_seconds(player):
+        return treatment_params(player.session).timeout_seconds('punishment')
+
     @staticmethod
     def vars_for_template(player):
-        id_range = list(range(1, Constants.players_per_group + 1))
-        endowment = player.session.config['endowment']
+        params = treatment_params(player.session)
+        endowment = params.endowment
         contribution = player.contribution if hasattr(player, 'contribution') else 0
 
         remaining_mu = endowment - contribution
+        group_players = group_context(player.group).players
 
         return dict(
-            players_contribution=player.group.get_players(),
-            deduction_points=player.session.config['deduction_points'],
-            id_range=id_range,
-            history_rounds=build_history_rounds(player),
-            can_receive_map={p.id_in_group: p.can_receive_punishment for p in player.group.get_players()},
+            group_players=group_players,
+            deduction_points=params.deduction_points,
+            has_history=player.round_number > 1,
+            can_receive_map={p.id_in_group: p.can_receive_punishment for p in group_players},
             remaining_mu = remaining_mu
         )
 
+    @staticmethod
+    def live_method(player, data):
+        return form_live_method(player, data, punishment_error)
+
     @staticmethod
     def error_message(player, values):
-        total_punishment = 0
-        for i in range(1, Constants.players_per_group + 1):
-            field_name = f'punish_p{i}'
-            if field_name in values and values[field_name] is not None:
-                total_punishment += values[field_name]
-
-        if total_punishment > player.session.config['deduction_points']:
-            return f"送られた点数 {player.session.config['deduction_points']}　を越えてはいけません。"
-        punishment_cost = player.session.config.get('punishment_cost', 1)
-        total_cost = total_punishment * punishment_cost
-        available = float(player.available_endowment or 0)
-        if total_cost > available + 1e-6:
-            if punishment_cost > 0:
-                max_points = int(available // punishment_cost)
-            else:
-                max_points = total_punishment
-            return f"現在、使えるMUsは {max_points} です。もう一度試して下さい。"
+        return punishment_error(player, values.get('punishments'))
 
     @staticmethod
     def before_next_page(player, timeout_happened):
-        punishment_cost = player.session.config.get('punishment_cost', 1)
-        total_punishment = 0
-        for i in range(1, Constants.players_per_group + 1):
-            field_name = f'punish_p{i}'
-            if hasattr(player, field_name):
-                value = getattr(player, field_name, 0) or 0
-                total_punishment += value
+        if timeout_happened:
+            # 時間切れ: 罰を与えない
+            player.punishment_timed_out = True
+            player.punishments = ''
+        punishment_cost = treatment_params(player.session).punishment_cost
+        punishments = parse_edges(player.punishments, set(punishable_ids(player)), integer=True)
+        player.punishments = encode_edges(punishments)
+        total_punishment = sum(punishments.values())
         total_cost = c(total_punishment * punishment_cost)
         player.available_before_punishment = player.available_endowment or c(0)
         player.attempted_punishment_cost = total_cost
         player.attempted_punishment_points = total_punishment
-        player.participant.vars['punishment_submitted_round'] = player.round_number
+        player.group.punishment_submitted += 1
 
 # =============================================================================
 # CLASS: PunishmentWaitPage
@@ -587,19 +775,17 @@ class PunishmentWaitPage(WaitPage):
 
     @staticmethod
     def after_all_players_arrive(group):
-        group.set_payoff()
+        settle_once(group, 'payoff', settle_payoff_phase)
 
     @staticmethod
     def vars_for_template(player):
-        players = player.group.get_players()
-        current_round = player.round_number
-        submitted = sum(
-            1
-            for p in players
-            if p.participant.vars.get('punishment_submitted_round') == current_round
-        )
-        total = len(players)
-        return dict(waiting_progress=submitted, waiting_total=total)
+        progress = waiting_progress(player.group, 'punishment_submitted')
+        return dict(waiting_progress=progress['submitted'], waiting_total=progress['total'])
+
+    @staticmethod
+    def live_method(player, data):
+        # 待機ページを開いた参加者から届き、グループ全員の表示を更新する
+        return {0: waiting_progress(player.group, 'punishment_submitted')}
 
 # =============================================================================
 # CLASS: RoundResult
@@ -611,130 +797,28 @@ class RoundResult(Page):
 
     @staticmethod
     def vars_for_template(player):
-        session = player.session
-        treatment_name = session.config.get('treatment_name', 'fixed')
-        show_power_transfer = (
-            session.config.get('power_transfer_allowed')
-            and player.round_number >= 3
-        )
-
-        endowment = session.config['endowment']
-        deduction_points = session.config['deduction_points']
-        endowment_currency = c(endowment)
-        share = player.group.individual_share
-
-        cumulative_payoff = player.participant.vars.get('cumulative_payoff', c(0))
-        payoff_from_contribution = endowment_currency - player.contribution + share
-
-        players = sorted(player.group.get_players(), key=lambda p: p.id_in_group)
-
-        players_map = {}
-        for member in players:
-            players_map[member.id_in_group] = dict(
-                id_in_group=member.id_in_group,
-                contribution=member.contribution,
-                endowment=endowment_currency,
-                punishment_sent_total=0,
-                punishment_received_total=0,
-                power_before=member.punishment_power_before,
-                power_after=member.punishment_power_after,
-                power_after_display=f"{member.punishment_power_after:.1f}",
-                power_transfer_out=member.power_transfer_out_total,
-                power_transfer_in=member.power_transfer_in_total,
-                power_transfer_out_display=f"{member.power_transfer_out_total:.1f}",
-                power_transfer_in_display=f"{member.power_transfer_in_total:.1f}",
-                power_transfer_cost=member.power_transfer_cost,
-                available_endowment=member.available_endowment,
-                available_before_contribution=member.available_before_contribution or (member.available_endowment or c(0)) + member.contribution,
-            )
-
-        for member in players:
-            total_sent = getattr(member, 'punishment_points_given_actual', None)
-            if total_sent is None:
-                total_sent = 0
-                for other in players:
-                    if other.id_in_group == member.id_in_group:
-                        continue
-                    field_name = f'punish_p{other.id_in_group}'
-                    total_sent += getattr(member, field_name, 0) or 0
-            players_map[member.id_in_group]['punishment_sent_total'] = total_sent
-
-        effectiveness_base = session.config.get('power_effectiveness', Constants.power_effectiveness)
-        matrix_rows = []
-        for victim in players:
-            actual_loss = float(victim.punishment_received or 0)
-            if actual_loss <= 0:
-                victim_before = float(victim.available_before_punishment or victim.available_endowment or 0)
-                victim_after = float(victim.available_endowment or 0)
-                diff = victim_before - victim_after
-                if diff > actual_loss:
-                    actual_loss = max(0.0, diff)
-
-            attempted_loss = 0.0
-            attempted_points = {}
-            effective_power_map = {}
-            for giver in players:
-                if giver.id_in_group == victim.id_in_group:
-                    continue
-                points = getattr(giver, f'punish_p{victim.id_in_group}', 0) or 0
-                attempted_points[giver.id_in_group] = points
-                effective_power = (
-                    giver.punishment_power_after
-                    or giver.participant.vars.get('punishment_power', 1.0)
-                )
-                effective_power_map[giver.id_in_group] = effective_power
-                if points > 0:
-                    attempted_loss += points * effectiveness_base * effective_power
-
-            if attempted_loss <= 0:
-                scale = 0.0
-            else:
-                scale = min(1.0, actual_loss / attempted_loss)
-
-            cells = []
-            total_received = 0.0
-            for giver in players:
-                is_self = giver.id_in_group == victim.id_in_group
-                if is_self:
-                    cells.append(dict(is_self=True, amount=None, amount_display=None))
-                else:
-                    points_attempted = attempted_points.get(giver.id_in_group, 0)
-                    points_used = round(points_attempted * scale, 6)
-                    effective_power = effective_power_map.get(
-                        giver.id_in_group,
-                        giver.punishment_power_after
-                        or giver.participant.vars.get('punishment_power', 1.0),
-                    )
-                    actual_loss_value = points_used * effectiveness_base * effective_power
-                    total_received += actual_loss_value
-                    loss_display = c(actual_loss_value)
-                    cells.append(
-                        dict(
-                            is_self=False,
-                            amount=loss_display,
-                            amount_display=loss_display,
-                        )
-                    )
-
-            if victim.punishment_received is not None:
-                summary_loss = victim.punishment_received
-            else:
-                summary_loss = c(total_received)
+        params = treatment_params(player.session)
+        group = player.group
+        treatment_name = params.treatment_name
+        show_power_transfer = params.has_power_transfer(player.round_number)
 
-            players_map[victim.id_in_group]['punishment_received_total'] = summary_loss
-            matrix_rows.append(dict(victim_id=victim.id_in_group, cells=cells))
+        endowment_currency = c(params.endowment)
+        summary = group.summary().get('round')
+        if summary is None:
+            summary = present_history_round(build_round_snapshot(group))
 
-        players_summary = [players_map[idx] for idx in sorted(players_map.keys())]
+        cumulative_payoff = player.cumulative_payoff
+        payoff_from_contribution = endowment_currency - player.contribution + group.individual_share
 
         return dict(
             payoff_from_contribution=payoff_from_contribution,
             cumulative_payoff=cumulative_payoff,
-            players_summary=players_summary,
-            matrix_rows=matrix_rows,
-            matrix_headers=[member.id_in_group for member in players],
+            players_summary=summary['players'],
+            matrix_rows=summary['matrix_rows'],
+            matrix_headers=[entry['id_in_group'] for entry in summary['players']],
             show_power_transfer=show_power_transfer,
             treatment_name=treatment_name,
-            deduction_points=deduction_points,
+            deduction_points=params.deduction_points,
             endowment=endowment_currency,
         )
 
@@ -763,7 +847,7 @@ class FinalResult(Page):
         currency_code = player.session.config.get('real_world_currency_code', 'JPY')
 
         return {
-            'players': sorted(player.group.get_players(), key=lambda p: p.id_in_group),
+            'players': player.group.summary().get('final') or build_final_summary(player.group),
             'final_payoff_jpy': final_payoff_jpy,
             'C': Constants,
             'Constants': Constants,
@@ -776,6 +860,7 @@ class FinalResult(Page):
 # ページの表示順
 # =============================================================================
 page_sequence = [
+    ArrivalWaitPage,  # <--- 到着順のグループ分けは最初のページでなければならない
     PowerTransfer,
     PowerTransferWait,
     PowerTransferResult,
@@ -787,3 +872,6 @@ page_sequence = [
     RoundResult,
     FinalResult, # <--- ゲームアプリの最後に表示する最終結果ページ
 ]
+
+# profile_pages が有効なセッションでフックの実行時間などを記録
+instrument_pages(page_sequence, Constants.name_in_url)
@@ -0,0 +1,156 @@
+# game/profiling.py
+"""
+ページフックの計測（オプトイン）
+
+セッション設定で profile_pages=True を指定すると、instrument_pages() で
+ラップしたページの vars_for_template / error_message / before_next_page /
+after_all_players_arrive の 1 回ごとに、実行時間・DB クエリ数・戻り値の
+サイズを PageProfile に記録する。集計結果は custom_export_page_profile で
+セッションごとにダウンロードできる。無効なセッションでは元の関数をそのまま呼ぶ。
+"""
+
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+
+from .models import PageProfile, treatment_params
+
+PROFILED_HOOKS = (
+    'vars_for_template',
+    'error_message',
+    'before_next_page',
+    'after_all_players_arrive',
+)
+
+_query_counter = threading.local()
+_listener_installed = False
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _query_counter.count = getattr(_query_counter, 'count', 0) + 1
+
+
+def _install_query_listener():
+    global _listener_installed
+    if _listener_installed:
+        return
+    from sqlalchemy import event
+    from otree.database import engine
+
+    event.listen(engine, 'before_cursor_execute', _count_query)
+    _listener_installed = True
+
+
+def payload_size(result):
+    """戻り値を JSON にしたときのバイト数（None は 0）"""
+    if result is None:
+        return 0
+    if isinstance(result, str):
+        return len(result.encode('utf8'))
+    return len(json.dumps(result, default=str, ensure_ascii=False).encode('utf8'))
+
+
+def _profiled(func, app_name, page_name, hook):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # 第 1 引数は player / group / subsession（after_all_players_arrive はキーワード渡し）
+        subject = args[0] if args else next(iter(kwargs.values()))
+        session = subject.session
+        if not session.config.get('profile_pages'):
+            return func(*args, **kwargs)
+
+        _install_query_listener()
+        queries_before = getattr(_query_counter, 'count', 0)
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        wall_ms = (time.perf_counter() - started) * 1000
+        queries = getattr(_query_counter, 'count', 0) - queries_before
+
+        PageProfile.create(
+            session_code=session.code,
+            treatment=treatment_params(session).treatment_name,
+            app_name=app_name,
+            page_name=page_name,
+            hook=hook,
+            round_number=subject.round_number,
+            wall_ms=wall_ms,
+            queries=queries,
+            payload_bytes=payload_size(result),
+        )
+        return result
+
+    return staticmethod(wrapper)
+
+
+def instrument_pages(page_sequence, app_name):
+    """page_sequence の各ページが定義しているフックを計測用の関数に置き換える"""
+    for page in page_sequence:
+        for hook in PROFILED_HOOKS:
+            func = page.__dict__.get(hook)
+            if isinstance(func, staticmethod):
+                setattr(page, hook, _profiled(func.__func__, app_name, page.__name__, hook))
+
+
+REPORT_HEADER = [
+    'session_code',
+    'treatment',
+    'app_name',
+    'page_name',
+    'hook',
+    'round_number',
+    'calls',
+    'total_ms',
+    'mean_ms',
+    'max_ms',
+    'mean_queries',
+    'max_queries',
+    'mean_payload_bytes',
+    'max_payload_bytes',
+]
+
+
+def profile_report(session_codes):
+    """セッション・ページ・フック・ラウンドごとの集計行"""
+    buckets = defaultdict(list)
+    for session_code in session_codes:
+        for sample in PageProfile.objects_filter(session_code=session_code):
+            key = (
+                sample.session_code,
+                sample.treatment,
+                sample.app_name,
+                sample.page_name,
+                sample.hook,
+                sample.round_number,
+            )
+            buckets[key].append(sample)
+
+    rows = []
+    for key in sorted(buckets):
+        samples = buckets[key]
+        calls = len(samples)
+        wall = [s.wall_ms for s in samples]
+        queries = [s.queries for s in samples]
+        payload = [s.payload_bytes for s in samples]
+        rows.append(
+            list(key)
+            + [
+                calls,
+                round(sum(wall), 3),
+                round(sum(wall) / calls, 3),
+                round(max(wall), 3),
+                round(sum(queries) / calls, 2),
+                max(queries),
+                round(sum(payload) / calls, 1),
+                max(payload),
+            ]
+        )
+    return rows
+
+
+def custom_export_page_profile(players):
+    """ページ計測レポート（profile_pages が有効なセッションのみ行が出る）"""
+    yield REPORT_HEADER
+    session_codes = sorted({p.session.code for p in players})
+    yield from profile_report(session_codes)
@@ -0,0 +1,133 @@
+# game/settlement.py
+"""
+懲罰フェーズ・罰威力移譲フェーズの精算ロジック
+
+グループ全体の罰ポイント（与えた人・受けた人ごとの辺）と罰威力ベクトルを
+受け取り、実際に使われた罰ポイント・損失・コストを一度にまとめて計算する。
+oTree のモデルには依存しないため、ページ表示やシミュレーションからも同じ
+計算を再利用できる。
+
+辺はすべて {(与えた人, 受けた人): 値} の辞書で、インデックスは id_in_group - 1。
+0 の辺は持たないため、計算量はグループの人数ではなく辺の数に比例する。
+"""
+
+TOLERANCE = 1e-9
+
+
+def settle_punishments(
+    attempted,
+    powers,
+    available,
+    attempted_costs,
+    effectiveness=1.0,
+    cost_per_point=1.0,
+):
+    """Settle one group's punishment phase in a single batched pass.
+
+    attempted: {(giver, receiver): points} (self-punishment is ignored)
+    powers: punishment power of each giver
+    available: MUs each player holds before the punishment phase
+    attempted_costs: cost each giver declared on the Punishment page
+    """
+    n = len(available)
+    players = range(n)
+    loss_per_point = [effectiveness * power for power in powers]
+
+    # 自分自身への罰と 0 以下の入力は無効
+    points = {
+        (g, v): amount
+        for (g, v), amount in attempted.items()
+        if g != v and (amount or 0) > 0
+    }
+    attempted_loss = [0.0] * n
+    for (g, v), amount in points.items():
+        attempted_loss[v] += amount * loss_per_point[g]
+
+    # 受けた人の保有額を超える場合は、罰を比例的に縮小する
+    scale = []
+    for v in players:
+        if attempted_loss[v] <= available[v] + TOLERANCE:
+            scale.append(1.0)
+        elif attempted_loss[v] <= 0 or available[v] <= 0:
+            scale.append(0.0)
+        else:
+            scale.append(available[v] / attempted_loss[v])
+
+    points_used = {
+        (g, v): round(amount * scale[v], 6)
+        for (g, v), amount in points.items()
+    }
+    loss = {
+        (g, v): amount * loss_per_point[g]
+        for (g, v), amount in points_used.items()
+    }
+
+    points_sent = [0.0] * n
+    points_received = [0.0] * n
+    losses = [0.0] * n
+    for (g, v), amount in points_used.items():
+        points_sent[g] += amount
+        points_received[v] += amount
+        losses[v] += loss[(g, v)]
+    costs = [
+        min(points_sent[i] * cost_per_point, attempted_costs[i])
+        for i in players
+    ]
+    available_after = [
+        max(0.0, available[i] - losses[i] - costs[i])
+        for i in players
+    ]
+
+    return dict(
+        points_used=points_used,
+        loss=loss,
+        points_sent=points_sent,
+        points_received=points_received,
+        losses=losses,
+        costs=costs,
+        available_after=available_after,
+    )
+
+
+def transfer_cost(total_out, unit, rate, costly):
+    """罰威力を total_out だけ移譲するときのコスト（コストなしの条件では 0）"""
+    if costly and unit > 0:
+        units = total_out / unit
+        return units * rate
+    return 0.0
+
+
+def available_after_transfer(endowment, cost, costly):
+    """移譲フェーズ後の保有額と、罰を受けられるかどうか
+
+    コストありの条件で移譲コストを払った人は、このラウンドの罰を受けない。
+    """
+    return max(0, endowment - cost), not (costly and cost > 0)
+
+
+def available_after_contribution(available, contribution, can_receive_punishment):
+    """貢献後の残りの保有額と、罰を受けられるかどうか
+
+    残りが 0 の人からは罰で差し引けないので、罰を受けない。
+    """
+    remaining = max(0, available - contribution)
+    return remaining, can_receive_punishment and remaining > 0
+
+
+def settle_power_transfers(transfers, powers_before, out_totals):
+    """Settle one group's power transfers.
+
+    transfers: {(giver, receiver): amount} (self-transfers are ignored)
+    powers_before: punishment power of each player before the transfer phase
+    out_totals: total amount each player gave (as stored on the Player)
+    """
+    in_totals = [0] * len(powers_before)
+    for (g, r), amount in transfers.items():
+        if g != r:
+            in_totals[r] += amount
+    in_totals = [round(total, 3) for total in in_totals]
+    powers_after = [
+        max(0, round(before - out_total + in_total, 3))
+        for before, out_total, in_total in zip(powers_before, out_totals, in_totals)
+    ]
+    return dict(in_totals=in_totals, powers_after=powers_after)
@@ -0,0 +1,283 @@
+# game/simulation.py
+"""
+ゲームのルールをそのまま使うオフラインのシミュレーション
+
+ページと同じ精算関数 (settlement.py) を使い、oTree のモデルや DB を介さずに
+ラウンドを進める。金額はページで c() を通す位置と同じ位置で Currency と
+同じ桁数に丸めるため、同じ意思決定からは実際のセッションと同じ利得になる
+（tools/simulate.py --verify で確認できる）。
+
+意思決定はボットの戦略 (bot_strategies.py) で行う。1 回の呼び出しで
+多数のセッションをまとめて進め、集計値（ラウンドごとの合計）だけを返す
+ので、プロセスごとに分割した結果は merge_totals で足し合わせられる。
+"""
+
+import random
+from functools import lru_cache
+
+from otree.api import Currency as c
+
+from .bot_strategies import MIXED_ORDER, STRATEGIES
+from .models import Constants, default_contribution, treatment_params
+from .settlement import (
+    available_after_contribution,
+    available_after_transfer,
+    settle_power_transfers,
+    settle_punishments,
+    transfer_cost,
+)
+
+# ラウンドごとに合計する値
+METRICS = (
+    'contribution',
+    'payoff',
+    'punishment_points',
+    'punishment_loss',
+    'power_transferred',
+    'max_power',
+    'immune_players',
+)
+
+
+@lru_cache(maxsize=65536)
+def currency(amount):
+    """Currency と同じ桁数・丸め方で丸めた値 (float)"""
+    return float(c(amount))
+
+
+class SimSession:
+    def __init__(self, config):
+        self.config = config
+        self.params = treatment_params(self)
+
+
+class SimPlayer:
+    """シミュレーション上の参加者
+
+    戦略からは Player の代わりとして渡されるため、戦略が参照する属性
+    (session, id_in_group, available_endowment, punishment_power_before,
+    previous_contribution) を持つ。
+    """
+
+    def __init__(self, session, index, decisions):
+        self.session = session
+        self.index = index
+        self.decisions = decisions
+        self.id_in_group = None
+        self.punishment_power_before = 1.0
+        self.punishment_power_after = 1.0
+        self.available_endowment = currency(session.params.endowment)
+        self.contribution = 0
+        self.cumulative_payoff = 0.0
+
+    def start_round(self, id_in_group):
+        """Player.start_round と同じ初期状態（罰威力は前ラウンドから引き継ぐ）"""
+        endowment = currency(self.session.params.endowment)
+        self.id_in_group = id_in_group
+        self.previous_contribution = self.contribution
+        self.punishment_power_before = self.punishment_power_after
+        self.power_transfer_cost = 0.0
+        self.available_endowment = endowment
+        self.can_receive_punishment = True
+
+
+class StrategyDecisions:
+    """ボットの戦略による意思決定（ボットが送信する値と同じ形にする）
+
+    時間切れはページの before_next_page と同じ既定の行動にする。
+    """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+
+    def power_transfers(self, player, round_number, others):
+        if self.strategy.times_out():
+            return {}
+        unit = player.session.params.punishment_transfer_unit
+        units = self.strategy.power_transfer(player, others)
+        return {receiver: round(n * unit, 6) for receiver, n in units.items()}
+
+    def contribution(self, player, round_number):
+        if self.strategy.times_out():
+            return default_contribution(player)
+        return self.strategy.contribution(player)
+
+    def punishments(self, player, round_number, targets):
+        if self.strategy.times_out():
+            return {}
+        return self.strategy.punishment(player, targets)
+
+
+def make_decisions(config, strategy_name, index, rng):
+    """参加者 index (0 始まり) の意思決定（'mixed' は get_strategy と同じ順で割り当てる）"""
+    if strategy_name == 'mixed':
+        strategy_name = MIXED_ORDER[index % len(MIXED_ORDER)]
+    if strategy_name not in STRATEGIES:
+        raise ValueError(f'Unknown bot_strategy: {strategy_name}')
+    return StrategyDecisions(STRATEGIES[strategy_name](rng))
+
+
+def empty_totals(num_rounds):
+    return dict(
+        sessions=0,
+        players=0,
+        final_payoff=0.0,
+        rounds=[dict.fromkeys(METRICS, 0) for _ in range(num_rounds)],
+    )
+
+
+def merge_totals(totals, other):
+    """simulate_sessions の結果を足し合わせる"""
+    totals['sessions'] += other['sessions']
+    totals['players'] += other['players']
+    totals['final_payoff'] += other['final_payoff']
+    for mine, theirs in zip(totals['rounds'], other['rounds']):
+        for key in METRICS:
+            mine[key] += theirs[key]
+    return totals
+
+
+def play_round(params, round_number, members, totals=None):
+    """1 グループ・1 ラウンドを進め、各メンバーの利得を返す
+
+    params は TreatmentParams、members は id_in_group 順の SimPlayer（start_round 済み）。
+    ページの順番（罰威力の移譲 → 貢献 → 懲罰）に合わせて各フェーズを精算する。
+    """
+    n = len(members)
+    endowment = params.endowment
+    ids = [member.id_in_group for member in members]
+    index_of = {member.id_in_group: index for index, member in enumerate(members)}
+    costly = params.costly_punishment_transfer
+    transferred = 0
+
+    # PowerTransfer / PowerTransferWait
+    if params.has_power_transfer(round_number):
+        transfers = {}
+        out_totals = []
+        for g, member in enumerate(members):
+            others = [i for i in ids if i != member.id_in_group]
+            sent = member.decisions.power_transfers(member, round_number, others)
+            sent = {receiver: float(amount) for receiver, amount in sent.items() if amount}
+            total_out = sum(sent.values())
+            out_totals.append(round(total_out, 3))
+            member.power_transfer_cost = currency(
+                transfer_cost(
+                    total_out,
+                    unit=params.punishment_transfer_unit,
+                    rate=params.power_transfer_cost_rate,
+                    costly=costly,
+                )
+            )
+            for receiver, amount in sorted(sent.items()):
+                transfers[(g, index_of[receiver])] = amount
+        result = settle_power_transfers(
+            transfers,
+            powers_before=[member.punishment_power_before for member in members],
+            out_totals=out_totals,
+        )
+        for index, member in enumerate(members):
+            member.punishment_power_after = result['powers_after'][index]
+            remaining, member.can_receive_punishment = available_after_transfer(
+                endowment, member.power_transfer_cost, costly=costly
+            )
+            member.available_endowment = currency(remaining)
+        transferred = sum(out_totals)
+
+    # Contribution / ContributionWaitPage
+    contributions = []
+    for member in members:
+        contribution = member.decisions.contribution(member, round_number)
+        member.contribution = contribution
+        contributions.append(contribution)
+        remaining, member.can_receive_punishment = available_after_contribution(
+            member.available_endowment, contribution, member.can_receive_punishment
+        )
+        member.available_endowment = currency(remaining)
+    share = currency(float(sum(contributions)) * params.contribution_multiplier / n)
+
+    # Punishment / PunishmentWaitPage（第 1 ラウンドは懲罰フェーズなしで精算）
+    punishment_cost = params.punishment_cost
+    attempted = {}
+    attempted_costs = []
+    for g, member in enumerate(members):
+        points = {}
+        if round_number > 1:
+            targets = [
+                other.id_in_group
+                for other in members
+                if other is not member and other.can_receive_punishment
+            ]
+            points = member.decisions.punishments(member, round_number, targets)
+            points = {receiver: int(k) for receiver, k in points.items() if k}
+        attempted_costs.append(currency(sum(points.values()) * punishment_cost))
+        for receiver, k in sorted(points.items()):
+            attempted[(g, index_of[receiver])] = k
+    result = settle_punishments(
+        attempted=attempted,
+        powers=[member.punishment_power_after for member in members],
+        available=[member.available_endowment for member in members],
+        attempted_costs=attempted_costs,
+        effectiveness=params.power_effectiveness,
+        cost_per_point=params.punishment_cost,
+    )
+
+    payoffs = []
+    for index, member in enumerate(members):
+        member.available_endowment = currency(result['available_after'][index])
+        costs = (
+            currency(result['costs'][index])
+            + currency(result['losses'][index])
+            + member.power_transfer_cost
+        )
+        payoff = currency(endowment - contributions[index] + share - costs)
+        member.cumulative_payoff = currency(member.cumulative_payoff + payoff)
+        payoffs.append(payoff)
+
+    if totals is not None:
+        stats = totals['rounds'][round_number - 1]
+        stats['contribution'] += sum(contributions)
+        stats['payoff'] += sum(payoffs)
+        stats['punishment_points'] += sum(result['points_sent'])
+        stats['punishment_loss'] += sum(result['losses'])
+        stats['power_transferred'] += transferred
+        stats['max_power'] += max(member.punishment_power_after for member in members)
+        stats['immune_players'] += sum(not member.can_receive_punishment for member in members)
+    return payoffs
+
+
+def simulate_sessions(config, num_sessions, groups_per_session=1, strategy='mixed', seed=0, first_session=0):
+    """num_sessions 個のセッションを最後のラウンドまで進め、集計値を返す
+
+    セッションは groups_per_session 個のグループからなり、initialize_all_rounds と
+    同じくラウンドごとにメンバーをランダムに組み直す（1 グループなら固定）。
+    乱数はセッション番号から決まるため、分割して実行しても結果は変わらない。
+    """
+    # アプリと同じく常に Constants.num_rounds ラウンド（session config では変えられない）
+    num_rounds = Constants.num_rounds
+    session = SimSession(config)
+    size = session.params.players_per_group
+    totals = empty_totals(num_rounds)
+
+    for session_index in range(first_session, first_session + num_sessions):
+        rng = random.Random(f'{seed}-{session_index}')
+        players = [
+            SimPlayer(
+                session,
+                index,
+                make_decisions(config, strategy, index, random.Random(f'{seed}-{session_index}-{index}')),
+            )
+            for index in range(size * groups_per_session)
+        ]
+        for round_number in range(1, num_rounds + 1):
+            order = list(players)
+            if groups_per_session > 1:
+                rng.shuffle(order)
+            for start in range(0, len(order), size):
+                members = order[start:start + size]
+                for id_in_group, member in enumerate(members, start=1):
+                    member.start_round(id_in_group)
+                play_round(session.params, round_number, members, totals)
+        totals['sessions'] += 1
+        totals['players'] += len(players)
+        totals['final_payoff'] += sum(player.cumulative_payoff for player in players)
+    return totals
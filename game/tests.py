@@ -1,68 +1,141 @@
-from otree.api import Bot, Submission
+import json
+
+from otree.api import Bot, Currency as c, Submission, SubmissionMustFail, expect
+from otree.database import db
 
 from . import pages
-from .models import Constants
+from .bot_strategies import get_strategy
+from .models import Constants, group_context, treatment_params
+
+
+def live_error(page, player, value):
+    """入力中の検証 (live_method) が value に返すエラーメッセージ"""
+    reply = page.live_method(player, dict(type='validate', seq=1, value=value))
+    return reply[player.id_in_group]['error']
 
 
-def punishment_form(player, points):
-    data = {}
-    for i in range(1, Constants.players_per_group + 1):
-        if i == player.id_in_group:
-            continue
-        data[f'punish_p{i}'] = points
-    return data
+def history_reply(page, player, value):
+    """履歴モーダルの要求 (page=value) に live_method が返すページ番号"""
+    reply = page.live_method(player, dict(type='history', page=value))
+    return reply[player.id_in_group]['page']
 
 
-def power_transfer_form(player, amount):
-    data = {}
-    for i in range(1, Constants.players_per_group + 1):
-        if i == player.id_in_group:
-            continue
-        data[f'power_transfer_p{i}'] = amount
-    return data
+def expect_punishment_rule(player):
+    """罰の精算ルール（user-002 以降）
+
+    - コストは実際に使われた（縮小後の）ポイントの分だけ。縮小で 0 ポイントに
+      なった罰にコストはかからない（入力したコスト全額を請求しない）
+    - 保有額からは受けた損失と与えた罰のコストの両方を引く
+    """
+    if player.punishment_points_given_actual == 0:
+        expect(player.punishment_given, c(0))
+    if player.punishment_points_received_actual == 0:
+        expect(player.punishment_received, c(0))
+    spent = float(player.punishment_given + player.punishment_received)
+    remaining = max(0.0, float(player.available_before_punishment) - spent)
+    # 各値は Currency (小数 1 桁) に丸めて保存されるので、丸めの差だけ許す
+    expect(abs(float(player.available_endowment) - remaining), '<', 0.2)
 
 
 class PlayerBot(Bot):
+    def current_player(self):
+        # サーバー側で更新された値を読むため、キャッシュ済みのオブジェクトを破棄する
+        db.expire_all()
+        return self.player
+
     def play_round(self):
-        treatment = self.session.config.get('treatment_name', 'fixed')
+        strategy = get_strategy(self.session, self.participant, self.round_number)
+        params = treatment_params(self.session)
+        player = self.current_player()
+        # 到着順でないセッションも、セッション作成時に players_per_group 人ずつに
+        # 分けられている（oTree は ArrivalWaitPage があると全員を 1 グループで作る）
+        if not params.group_by_arrival_time:
+            num_groups = len(self.session.get_participants()) // params.players_per_group
+            expect(len(player.subsession.get_groups()), num_groups)
+        expect(len(group_context(player.group).players), params.players_per_group)
 
-        if treatment in {'transfer_free', 'transfer_cost'}:
-            # Power transfer from round 3 onwards
-            if self.player.round_number >= 3:
-                yield Submission(
+        if pages.PowerTransfer.is_displayed(player):
+            unit = params.punishment_transfer_unit
+            others = [other.id_in_group for other in group_context(player.group).others(player)]
+            if strategy.submit_invalid:
+                too_much = {others[0]: round(player.punishment_power_before + unit, 6)}
+                expect(live_error(pages.PowerTransfer, player, json.dumps(too_much)), '!=', None)
+                yield SubmissionMustFail(
                     pages.PowerTransfer,
-                    power_transfer_form(self.player, 0.1),
+                    {'power_transfers': json.dumps(too_much)},
                     check_html=False,
                 )
-                yield pages.PowerTransferResult
-
-            # Contribution: 10 MUs each round
-            yield Submission(pages.Contribution, {'contribution': 10}, check_html=False)
-            yield pages.ContributionResult
-
-            if self.player.round_number > 1:
-                # Punish every other participant with 1 point (cost 1 MU per point)
-                yield Submission(
-                    pages.Punishment,
-                    punishment_form(self.player, 1),
+                # 自分自身への移譲は受け付けない
+                yield SubmissionMustFail(
+                    pages.PowerTransfer,
+                    {'power_transfers': json.dumps({player.id_in_group: unit})},
                     check_html=False,
                 )
-                yield pages.RoundResult
-
-            if self.player.round_number == Constants.num_rounds:
-                yield pages.FinalResult
+                # 空の入力は「移譲なし」として通さない（相手ごとの値がまとめられていない）
+                expect(live_error(pages.PowerTransfer, player, ''), '!=', None)
+                yield SubmissionMustFail(pages.PowerTransfer, {'power_transfers': ''}, check_html=False)
+            if strategy.times_out():
+                yield Submission(pages.PowerTransfer, {}, timeout_happened=True, check_html=False)
+            else:
+                units = strategy.power_transfer(player, others)
+                transfers = json.dumps({i: round(n * unit, 6) for i, n in units.items()})
+                expect(live_error(pages.PowerTransfer, player, transfers), None)
+                yield Submission(pages.PowerTransfer, {'power_transfers': transfers}, check_html=False)
+            yield pages.PowerTransferResult
 
-        else:  # fixed treatment default bot
-            yield Submission(pages.Contribution, {'contribution': 0}, check_html=False)
-            yield pages.ContributionResult
+        player = self.current_player()
+        if self.round_number == Constants.num_rounds:
+            # 不正なページ番号は範囲内に丸めるか、最新のページにする
+            latest = history_reply(pages.Contribution, player, None)
+            expect(latest, '>=', 2)
+            expect(history_reply(pages.Contribution, player, 1), 1)
+            expect(history_reply(pages.Contribution, player, True), latest)
+            expect(history_reply(pages.Contribution, player, False), latest)
+            expect(history_reply(pages.Contribution, player, '1'), latest)
+            expect(history_reply(pages.Contribution, player, -3), 0)
+            expect(history_reply(pages.Contribution, player, 999), latest)
+        if strategy.submit_invalid:
+            too_much = int(float(player.available_endowment)) + 1
+            expect(live_error(pages.Contribution, player, str(too_much)), '!=', None)
+            yield SubmissionMustFail(pages.Contribution, {'contribution': too_much}, check_html=False)
+        if strategy.times_out():
+            yield Submission(pages.Contribution, {}, timeout_happened=True, check_html=False)
+            player = self.current_player()
+            expect(player.contribution_timed_out, True)
+            default = min(player.previous_contribution, c(int(player.available_before_contribution)))
+            expect(player.contribution, default)
+        else:
+            contribution = strategy.contribution(player)
+            expect(live_error(pages.Contribution, player, str(contribution)), None)
+            yield Submission(pages.Contribution, {'contribution': contribution}, check_html=False)
+        yield pages.ContributionResult
 
-            if self.player.round_number > 1:
-                yield Submission(
+        if self.round_number > 1:
+            player = self.current_player()
+            targets = pages.punishable_ids(player)
+            if strategy.submit_invalid and targets:
+                too_much = {targets[0]: params.deduction_points + 1}
+                expect(live_error(pages.Punishment, player, json.dumps(too_much)), '!=', None)
+                yield SubmissionMustFail(
                     pages.Punishment,
-                    punishment_form(self.player, 0),
+                    {'punishments': json.dumps(too_much)},
                     check_html=False,
                 )
-                yield pages.RoundResult
+                yield SubmissionMustFail(pages.Punishment, {'punishments': ''}, check_html=False)
+            if strategy.times_out():
+                yield Submission(pages.Punishment, {}, timeout_happened=True, check_html=False)
+            else:
+                points = json.dumps(strategy.punishment(player, targets))
+                expect(live_error(pages.Punishment, player, points), None)
+                yield Submission(pages.Punishment, {'punishments': points}, check_html=False)
+            # 精算済みのグループでもう一度精算を呼んでも利得は変わらない
+            player = self.current_player()
+            expect(player.group.is_settled('payoff'), True)
+            cumulative = player.cumulative_payoff
+            pages.PunishmentWaitPage.after_all_players_arrive(player.group)
+            expect(player.cumulative_payoff, cumulative)
+            expect_punishment_rule(player)
+            yield pages.RoundResult
 
-            if self.player.round_number == Constants.num_rounds:
-                yield pages.FinalResult
+        if self.round_number == Constants.num_rounds:
+            yield pages.FinalResult
@@ -2,13 +2,16 @@
 
 from otree.api import Page, WaitPage
 
+from game.models import treatment_params
+from game.profiling import instrument_pages
+
 from .models import Constants
 
 class Introduction(Page): # 以前のバージョンでは IntroductionFixed だったページ
     @staticmethod
     def vars_for_template(player):
         return {
-            'treatment_name': player.session.config['treatment_name']
+            'treatment_name': treatment_params(player.session).treatment_name
         }
 
 class Test(Page): # 以前のバージョンでは TestFixed だったページ
@@ -16,7 +19,7 @@ class Test(Page): # 以前のバージョンでは TestFixed だったページ
 
     @staticmethod
     def get_form_fields(player):
-        treatment = player.session.config['treatment_name']
+        treatment = treatment_params(player.session).treatment_name
         if treatment == 'fixed':
             return ['q1_fixed', 'q2_fixed']
         elif treatment == 'transfer_free':
@@ -28,38 +31,39 @@ class Test(Page): # 以前のバージョンでは TestFixed だったページ
     @staticmethod
     def vars_for_template(player):
         return {
-            'treatment_name': player.session.config['treatment_name']
+            'treatment_name': treatment_params(player.session).treatment_name
         }
 
     @staticmethod
     def error_message(player, values):
-        treatment = player.session.config['treatment_name']
+        params = treatment_params(player.session)
+        treatment = params.treatment_name
         # 注意: ここで求める正解は実験設計に合わせて設定してください
         if treatment == 'fixed':
-            if values['q1_fixed'] != player.session.config['endowment'] or \
-               values['q2_fixed'] != player.session.config['contribution_multiplier']:
+            if values['q1_fixed'] != params.endowment or \
+               values['q2_fixed'] != params.contribution_multiplier:
                 return (
-                    f"固定条件の解答が正しくありません。初期保有額は{player.session.config['endowment']}、"
-                    f"公共財の乗数は{player.session.config['contribution_multiplier']}です。もう一度確認してください。"
+                    f"固定条件の解答が正しくありません。初期保有額は{params.endowment}、"
+                    f"公共財の乗数は{params.contribution_multiplier}です。もう一度確認してください。"
                 )
         elif treatment == 'transfer_free':
             # 罰威力は移譲可能で、移譲コストは設定値。最大移譲ポイントは初期の罰ポイント
-            expected_cost = player.session.config.get('power_transfer_cost_rate', 0)
+            expected_cost = params.power_transfer_cost_rate
             provided_cost = values.get('q2_transfer_free')
             cost_correct = (
                 provided_cost is not None
                 and abs(provided_cost - expected_cost) <= 1e-6
             )
             if not cost_correct or \
-               values['q3_transfer_free'] != player.session.config['deduction_points']:
+               values['q3_transfer_free'] != params.deduction_points:
                 return (
                     "無コスト移譲条件の解答が正しくありません。罰威力は移譲可能で、移譲コストは"
                     f"{expected_cost:.1f}、"
-                    f"最大移譲ポイントは{player.session.config['deduction_points']}です。もう一度確認してください。"
+                    f"最大移譲ポイントは{params.deduction_points}です。もう一度確認してください。"
                 )
         elif treatment == 'transfer_cost':
             # 罰威力は移譲可能でコスト率が設定値、移譲時にコストが発生すると仮定
-            expected_rate = player.session.config['power_transfer_cost_rate']
+            expected_rate = params.power_transfer_cost_rate
             cost_required_answer = values.get('q2_transfer_cost')
             provided_rate = values.get('q1_transfer_cost')
             rate_correct = (
@@ -74,3 +78,5 @@ class Test(Page): # 以前のバージョンでは TestFixed だったページ
                 )
 
 page_sequence = [Introduction, Test]
+
+instrument_pages(page_sequence, Constants.name_in_url)
@@ -1,17 +1,20 @@
 from otree.api import Bot, Submission
 
+from game.models import treatment_params
+
 from . import pages
 
 
 class PlayerBot(Bot):
     def play_round(self):
-        treatment = self.session.config.get('treatment_name')
+        params = treatment_params(self.session)
+        treatment = params.treatment_name
         yield pages.Introduction
 
-        endowment = self.session.config['endowment']
-        multiplier = self.session.config['contribution_multiplier']
-        deduction_points = self.session.config['deduction_points']
-        transfer_cost_rate = self.session.config.get('power_transfer_cost_rate', 0)
+        endowment = params.endowment
+        multiplier = params.contribution_multiplier
+        deduction_points = params.deduction_points
+        transfer_cost_rate = params.power_transfer_cost_rate
 
         if treatment == 'fixed':
             form_data = dict(q1_fixed=endowment, q2_fixed=multiplier)
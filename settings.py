@@ -22,7 +22,7 @@ ROOMS = [
     ),
 ]
 
-PARTICIPANT_FIELDS = ["punishment_points_history", "cumulative_payoff"] 
+PARTICIPANT_FIELDS = []
 SESSION_FIELDS = ["treatment"]
 
 SESSION_CONFIG_DEFAULTS = dict(
@@ -30,6 +30,11 @@ SESSION_CONFIG_DEFAULTS = dict(
     participation_fee=500,
     doc="公共財ゲーム。Roomsで条件を振り分け。",
     mturk_hit_settings=dict(),
+    bot_strategy='constant',  # ボットの戦略 (game/bot_strategies.py)
+    bot_seed=0,
+    profile_pages=False,  # True でページフックの計測を記録 (game/profiling.py)
+    group_by_arrival_time=False,  # True で到着順にグループを作る (game/pages.py ArrivalWaitPage)
+    decision_timeout_seconds=0,  # 貢献・移譲・懲罰ページの制限時間（秒、0 は制限なし）
 )
 
 SESSION_CONFIGS = [
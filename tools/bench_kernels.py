@@ -0,0 +1,327 @@
+"""
+Benchmark the game's computation kernels without a database.
+
+Run from the project root:
+
+    python tools/bench_kernels.py --json bench.json
+    python tools/bench_kernels.py --compare bench.json
+
+The kernels (Group.adjust_punishments, Player.set_payoff,
+settle_power_transfer_phase, build_history_rounds and
+history_page) are called on in-memory fake groups and players, over
+group sizes 5-50 and 1-100 rounds. --json writes one record per case, with the git commit,
+so that runs of different commits can be compared with --compare.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+GROUP_SIZES = [5, 10, 20, 50]
+ROUND_COUNTS = [1, 10, 20, 50, 100]
+
+CONFIG = dict(
+    endowment=20,
+    contribution_multiplier=1.5,
+    deduction_points=10,
+    power_effectiveness=1.0,
+    punishment_cost=1.0,
+    power_transfer_allowed=True,
+    costly_punishment_transfer=True,
+    power_transfer_cost_rate=1.0,
+    punishment_transfer_unit=0.1,
+)
+
+
+class FakeSession:
+    def __init__(self, config):
+        self.config = config
+
+
+class FakeParticipant:
+    def __init__(self, id_in_session):
+        self.id_in_session = id_in_session
+
+
+def make_fakes():
+    """Fake Group/Player classes that borrow the real methods from game."""
+    from game.models import Group, Player
+
+    class FakeModel:
+        def __init__(self, **fields):
+            self.__dict__.update(fields)
+
+        def field_maybe_none(self, name):
+            return getattr(self, name, None)
+
+    class FakePlayer(FakeModel):
+        set_payoff = Player.set_payoff
+        start_round = Player.start_round
+        effective_punishment_power = Player.effective_punishment_power
+        punishments_sent = Player.punishments_sent
+        power_transfers_sent = Player.power_transfers_sent
+
+        def get_others_in_group(self):
+            return [p for p in self.group.get_players() if p is not self]
+
+        def previous_groups(self):
+            return [p.group for p in self.history[: self.round_number - 1]]
+
+        def record_payoff(self, payoff):
+            self.payoff = payoff
+
+        def in_round(self, round_number):
+            return self.history[round_number - 1]
+
+    class FakeGroup(FakeModel):
+        set_group_contribution = Group.set_group_contribution
+        adjust_punishments = Group.adjust_punishments
+        edges = Group.edges
+        save_edges = Group.save_edges
+        summary = Group.summary
+        save_summary = Group.save_summary
+
+        def get_players(self):
+            return self.players
+
+    return FakeGroup, FakePlayer
+
+
+def build_group(FakeGroup, FakePlayer, session, participants, round_number, rng):
+    """A group at the end of the punishment phase of one round."""
+    from otree.api import Currency as c
+    from game.models import encode_edges
+
+    size = len(participants)
+    group = FakeGroup(
+        session=session,
+        round_number=round_number,
+        id_in_subsession=1,
+        round_edges='',
+        history_snapshot='',
+        round_summary='',
+        total_contribution=c(0),
+        individual_share=c(0),
+    )
+    players = []
+    for index, participant in enumerate(participants, start=1):
+        contribution = rng.randint(0, CONFIG['endowment'])
+        available = c(CONFIG['endowment'] - contribution)
+        power = round(rng.uniform(0, 2), 1)
+        fields = dict(
+            session=session,
+            participant=participant,
+            group=group,
+            id_in_group=index,
+            round_number=round_number,
+            contribution=c(contribution),
+            available_endowment=available,
+            available_before_contribution=c(CONFIG['endowment']),
+            available_before_punishment=available,
+            attempted_punishment_cost=c(0),
+            attempted_punishment_points=0,
+            punishment_power_before=power,
+            punishment_power_after=power,
+            power_transfer_out_total=0.0,
+            power_transfer_in_total=0.0,
+            power_transfer_cost=c(0),
+            punishment_given=c(0),
+            punishment_received=c(0),
+            punishment_points_given_actual=0,
+            punishment_points_received_actual=0,
+            can_receive_punishment=True,
+            previous_cumulative_payoff=c(0),
+            cumulative_payoff=c(0),
+            payoff=c(0),
+        )
+        budget = min(CONFIG['deduction_points'], int(float(available)))
+        punishments = {}
+        transfers = {}
+        power_left = power
+        for target in range(1, size + 1):
+            if target == index:
+                continue
+            punishments[target] = rng.randint(0, max(0, budget // (size - 1)))
+            # 移譲は手持ちの罰威力まで（監査の transfer_within_power を満たす）
+            transfers[target] = rng.choice([0.0, 0.1]) if power_left >= 0.1 - 1e-9 else 0.0
+            power_left = round(power_left - transfers[target], 3)
+        fields['punishments'] = encode_edges(punishments)
+        fields['power_transfers'] = encode_edges(transfers)
+        fields['power_transfer_out_total'] = round(sum(transfers.values()), 3)
+        fields['attempted_punishment_points'] = sum(punishments.values())
+        fields['attempted_punishment_cost'] = c(fields['attempted_punishment_points'])
+        players.append(FakePlayer(**fields))
+    group.players = players
+    return group
+
+
+def bench(func, min_time=0.2):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = timer.repeat(repeat=5, number=number)
+    return dict(
+        number=number,
+        best_s=min(runs) / number,
+        mean_s=sum(runs) / len(runs) / number,
+    )
+
+
+def run_cases(min_time, rounds_filter=None):
+    from game.pages import (
+        build_history_rounds,
+        history_page,
+        settle_power_transfer_phase,
+        store_round_history,
+    )
+
+    FakeGroup, FakePlayer = make_fakes()
+    session = FakeSession(CONFIG)
+    results = []
+
+    for size in GROUP_SIZES:
+        rng = random.Random(size)
+        participants = [FakeParticipant(i) for i in range(1, size + 1)]
+        group = build_group(FakeGroup, FakePlayer, session, participants, 3, rng)
+        group.set_group_contribution()
+
+        def settle():
+            group.adjust_punishments()
+
+        def payoffs():
+            for player in group.players:
+                player.set_payoff()
+
+        def transfers():
+            settle_power_transfer_phase(group)
+
+        for kernel, func in [
+            ('adjust_punishments', settle),
+            ('set_payoff', payoffs),
+            ('power_transfer_settlement', transfers),
+        ]:
+            results.append(dict(kernel=kernel, group_size=size, rounds=1, **bench(func, min_time)))
+            print_result(results[-1])
+
+        for rounds in ROUND_COUNTS:
+            if rounds_filter and rounds not in rounds_filter:
+                continue
+            rng = random.Random(f'{size}-{rounds}')
+            participants = [FakeParticipant(i) for i in range(1, size + 1)]
+            history = {p.id_in_session: [] for p in participants}
+            for round_number in range(1, rounds + 1):
+                past = build_group(FakeGroup, FakePlayer, session, participants, round_number, rng)
+                if round_number >= 3:
+                    settle_power_transfer_phase(past)
+                past.set_group_contribution()
+                past.adjust_punishments()
+                for player in past.players:
+                    history[player.participant.id_in_session].append(player)
+                    player.history = history[player.participant.id_in_session]
+                store_round_history(past)
+
+            # 次のラウンドのページを表示する時点の履歴
+            viewer = FakePlayer(
+                session=session,
+                participant=participants[0],
+                round_number=rounds + 1,
+                history=history[participants[0].id_in_session],
+            )
+            snapshots = [past.group.history_snapshot for past in viewer.history]
+
+            def history_stored():
+                build_history_rounds(viewer)
+
+            def history_latest_page():
+                history_page(viewer)
+
+            def history_cold():
+                # 保存済みスナップショットが無い場合の再構築
+                for past in viewer.history:
+                    past.group.history_snapshot = ''
+                build_history_rounds(viewer)
+
+            results.append(
+                dict(kernel='history_stored', group_size=size, rounds=rounds, **bench(history_stored, min_time))
+            )
+            print_result(results[-1])
+            results.append(
+                dict(kernel='history_page', group_size=size, rounds=rounds, **bench(history_latest_page, min_time))
+            )
+            print_result(results[-1])
+            results.append(
+                dict(kernel='history_cold', group_size=size, rounds=rounds, **bench(history_cold, min_time))
+            )
+            print_result(results[-1])
+            for past, snapshot in zip(viewer.history, snapshots):
+                past.group.history_snapshot = snapshot
+
+    return results
+
+
+def case_key(record):
+    return (record['kernel'], record['group_size'], record['rounds'])
+
+
+def print_result(record):
+    print(
+        f"{record['kernel']:<28} n={record['group_size']:<3} rounds={record['rounds']:<4} "
+        f"best {record['best_s'] * 1e6:>10.1f} us   mean {record['mean_s'] * 1e6:>10.1f} us",
+        flush=True,
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf8') as fp:
+        baseline = json.load(fp)
+    previous = {case_key(r): r for r in baseline['results']}
+    print(f"\ncompared with {baseline_path} (commit {baseline.get('commit')})")
+    for record in results:
+        old = previous.get(case_key(record))
+        if not old:
+            continue
+        ratio = record['best_s'] / old['best_s']
+        print(
+            f"{record['kernel']:<28} n={record['group_size']:<3} rounds={record['rounds']:<4} "
+            f"x{ratio:.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', dest='json_path', help='write the timings as JSON')
+    parser.add_argument('--compare', dest='baseline', help='JSON file of an earlier run')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timing run')
+    parser.add_argument('--rounds', type=int, nargs='*', help='only these history lengths')
+    args = parser.parse_args(argv)
+
+    os.chdir(PROJECT_ROOT)
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+    results = run_cases(args.min_time, args.rounds)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf8') as fp:
+            json.dump(dict(commit=git_commit(), results=results), fp, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Load test: drive full rooms of bots through each treatment and report
+per-page server latency.
+
+Run from the project root:
+
+    python tools/load_test.py --groups 20 --strategy mixed
+    python tools/load_test.py pggp_transfer_cost --groups 20 --json load.json
+
+Each treatment gets its own session of groups × players_per_group bots
+using the strategies in game/bot_strategies.py. Requests go through
+oTree's ASGI app in-process, so the timings are server-side handling
+times (including the redirect to the next page after a POST).
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+TREATMENTS = ['pggp_fixed', 'pggp_transfer_free', 'pggp_transfer_cost']
+
+
+def page_key(url):
+    """'/p/<code>/game/Contribution/12' -> 'game.Contribution'"""
+    parts = urlsplit(url).path.strip('/').split('/')
+    if len(parts) >= 4 and parts[0] == 'p':
+        return f'{parts[2]}.{parts[3]}'
+    return parts[0] if parts else url
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    summary = {}
+    for key, values in sorted(samples.items()):
+        values = sorted(values)
+        summary[key] = dict(
+            count=len(values),
+            p50_ms=percentile(values, 0.50) * 1000,
+            p90_ms=percentile(values, 0.90) * 1000,
+            p99_ms=percentile(values, 0.99) * 1000,
+            max_ms=values[-1] * 1000,
+        )
+    return summary
+
+
+def time_requests(bot, samples):
+    client = bot.client
+    for method in ('get', 'post'):
+        original = getattr(client, method)
+
+        def request(url, *args, _original=original, _method=method, **kwargs):
+            start = time.perf_counter()
+            response = _original(url, *args, **kwargs)
+            samples[f'{_method.upper()} {page_key(url)}'].append(time.perf_counter() - start)
+            return response
+
+        setattr(client, method, request)
+
+
+def run_treatment(config_name, *, groups, strategy, seed, profile=False):
+    import otree.session
+    from otree.bots.runner import SessionBotRunner, make_bots
+    from otree.database import db
+    from otree.session import SESSION_CONFIGS_DICT
+
+    from game.models import TreatmentParams
+
+    players_per_group = TreatmentParams.from_config(SESSION_CONFIGS_DICT[config_name]).players_per_group
+    num_participants = groups * players_per_group
+
+    started = time.perf_counter()
+    session = otree.session.create_session(
+        session_config_name=config_name,
+        num_participants=num_participants,
+        modified_session_config_fields=dict(
+            bot_strategy=strategy, bot_seed=seed, profile_pages=profile
+        ),
+    )
+    created = time.perf_counter()
+
+    bots = make_bots(session_pk=session.id, case_number=None, use_browser_bots=False)
+    session.mock_exogenous_data()
+    db.commit()
+
+    samples = defaultdict(list)
+    for bot in bots:
+        time_requests(bot, samples)
+    SessionBotRunner(bots=bots).play()
+    finished = time.perf_counter()
+
+    hooks = {}
+    if profile:
+        from game.profiling import REPORT_HEADER, profile_report
+
+        db.commit()
+        hooks = [dict(zip(REPORT_HEADER, row)) for row in profile_report([session.code])]
+
+    return dict(
+        treatment=config_name,
+        participants=num_participants,
+        groups=groups,
+        strategy=strategy,
+        seed=seed,
+        session_creation_s=created - started,
+        session_wall_time_s=finished - started,
+        pages=summarize(samples),
+        hooks=hooks,
+    )
+
+
+def print_report(result):
+    print(
+        f"\n== {result['treatment']}: {result['groups']} groups, "
+        f"{result['participants']} bots, strategy={result['strategy']}"
+    )
+    print(
+        f"session creation {result['session_creation_s']:.2f}s, "
+        f"total wall time {result['session_wall_time_s']:.2f}s"
+    )
+    print(f"{'request':<40} {'count':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for key, stats in result['pages'].items():
+        print(
+            f"{key:<40} {stats['count']:>6} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+            f"{stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}"
+        )
+    if result['hooks']:
+        totals = defaultdict(lambda: dict(calls=0, total_ms=0.0, queries=0.0))
+        for row in result['hooks']:
+            total = totals[f"{row['app_name']}.{row['page_name']}.{row['hook']}"]
+            total['calls'] += row['calls']
+            total['total_ms'] += row['total_ms']
+            total['queries'] += row['mean_queries'] * row['calls']
+        print(f"\n{'hook':<56} {'calls':>6} {'mean ms':>8} {'queries':>8}")
+        for key, total in sorted(totals.items(), key=lambda item: -item[1]['total_ms']):
+            print(
+                f"{key:<56} {total['calls']:>6} {total['total_ms'] / total['calls']:>8.2f} "
+                f"{total['queries'] / total['calls']:>8.1f}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('treatments', nargs='*', default=TREATMENTS)
+    parser.add_argument('--groups', type=int, default=20, help='groups per treatment')
+    parser.add_argument('--strategy', default='mixed', help='bot_strategy (see game/bot_strategies.py)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help='write the report as JSON')
+    parser.add_argument('--profile', action='store_true', help='record page hook timings (profile_pages)')
+    parser.add_argument('--verbose', action='store_true', help='show bot submissions')
+    args = parser.parse_args(argv)
+
+    os.chdir(PROJECT_ROOT)
+    sys.path.insert(0, str(PROJECT_ROOT))
+    os.environ['OTREE_IN_MEMORY'] = '1'
+
+    from otree.main import setup
+    from otree.database import session_scope
+
+    setup()
+    logging.getLogger('otree').setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    results = []
+    with session_scope():
+        for config_name in args.treatments:
+            result = run_treatment(
+                config_name,
+                groups=args.groups,
+                strategy=args.strategy,
+                seed=args.seed,
+                profile=args.profile,
+            )
+            print_report(result)
+            results.append(result)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf8') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Run the bot tests of every treatment and seed in parallel processes.
+
+Run from the project root:
+
+    python tools/run_bots.py
+    python tools/run_bots.py pggp_transfer_cost --seeds 0 1 2 3 --strategies mixed random
+    python tools/run_bots.py --groups 2 --workers 4 --json bots.json
+    python tools/run_bots.py --groups 3 --set group_by_arrival_time=true
+
+Each case (treatment × strategy × seed) runs in its own worker process
+with oTree's in-memory database, so cases never share data. After the
+bots finish, the stored results are checked against the payoff
+invariants below. One report lists pass/fail, violations and timing of
+every case; the exit status is non-zero if any case failed.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+TREATMENTS = ['pggp_fixed', 'pggp_transfer_free', 'pggp_transfer_cost']
+
+
+def init_worker(project_root):
+    """ワーカープロセスごとにメモリ上の DB で oTree を起動する"""
+    os.chdir(project_root)
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+    os.environ['OTREE_IN_MEMORY'] = '1'
+
+    from otree.main import setup
+
+    setup()
+    logging.getLogger('otree').setLevel(logging.WARNING)
+
+
+def check_invariants(session):
+    """保存済みの結果が利得のルールと合っているか（違反の説明のリスト）
+
+    グループごとの精算結果は game/audit.py と同じチェックで確認する。
+    """
+    from otree.api import Currency as c
+
+    from game.audit import find_violations
+    from game.models import Player, treatment_params
+
+    params = treatment_params(session)
+    violations = []
+    by_group = defaultdict(list)
+    by_participant = defaultdict(list)
+    for player in Player.objects_filter(session=session):
+        by_group[player.group_id].append(player)
+        by_participant[player.participant].append(player)
+
+    for members in by_group.values():
+        members.sort(key=lambda p: p.id_in_group)
+        group = members[0].group
+        where = f'round {group.round_number} group {group.id_in_subsession}'
+        if len(members) != params.players_per_group:
+            violations.append(f'{where}: {len(members)} members, expected {params.players_per_group}')
+        phases = ['contribution', 'payoff']
+        if params.has_power_transfer(group.round_number):
+            phases.insert(0, 'power_transfer')
+        for phase in phases:
+            if not group.is_settled(phase):
+                violations.append(f'{where}: {phase} not settled')
+        for item in find_violations(group, members, phases, settled_now=False):
+            who = f"{where} player {item['id_in_group']}" if item['id_in_group'] else where
+            violations.append(f"{who}: {item['check']} expected {item['expected']}, got {item['actual']}")
+        for p in members:
+            who = f'{where} player {p.id_in_group}'
+            if p.contribution_timed_out:
+                default = min(p.previous_contribution, c(int(p.available_before_contribution)))
+                if p.contribution != default:
+                    violations.append(f'{who}: timed-out contribution {p.contribution} != {default}')
+            if p.punishment_timed_out and p.punishment_given:
+                violations.append(f'{who}: timed-out punishment cost {p.punishment_given}')
+            if p.power_transfer_timed_out and p.power_transfer_out_total:
+                violations.append(f'{who}: timed-out power transfer {p.power_transfer_out_total}')
+
+    for participant, players in by_participant.items():
+        total = sum(p.payoff for p in players)
+        if participant.payoff != total:
+            violations.append(f'participant {participant.code}: payoff {participant.payoff} != {total}')
+        cumulative = max(players, key=lambda p: p.round_number).cumulative_payoff
+        if cumulative != total:
+            violations.append(f'participant {participant.code}: cumulative_payoff {cumulative} != {total}')
+    return violations
+
+
+def run_case(case):
+    """1 ケースをボットで最後まで進め、結果を dict で返す（例外もここで記録する）"""
+    import otree.session
+    from otree.bots.runner import SessionBotRunner, make_bots
+    from otree.database import db, session_scope
+    from otree.session import SESSION_CONFIGS_DICT
+
+    from game.models import TreatmentParams
+
+    result = dict(case, status='pass', error=None, violations=[])
+    started = time.perf_counter()
+    try:
+        with session_scope():
+            # --set players_per_group=... も参加者数に反映する
+            config = dict(SESSION_CONFIGS_DICT[case['treatment']], **case['overrides'])
+            players_per_group = TreatmentParams.from_config(config).players_per_group
+            session = otree.session.create_session(
+                session_config_name=case['treatment'],
+                num_participants=case['groups'] * players_per_group,
+                modified_session_config_fields=dict(
+                    case['overrides'], bot_strategy=case['strategy'], bot_seed=case['seed']
+                ),
+            )
+            bots = make_bots(session_pk=session.id, case_number=None, use_browser_bots=False)
+            db.commit()
+            SessionBotRunner(bots=bots).play()
+            db.commit()
+            result['violations'] = check_invariants(session)
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc(limit=-3)
+    else:
+        if result['violations']:
+            result['status'] = 'fail'
+    result['wall_time_s'] = time.perf_counter() - started
+    return result
+
+
+def parse_overrides(items):
+    """['key=value'] -> {'key': value}（値は JSON として読めれば JSON）"""
+    overrides = {}
+    for item in items or []:
+        key, _, value = item.partition('=')
+        if not value:
+            raise SystemExit(f'Expected key=value: {item}')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def print_report(results, wall_time):
+    print(f"\n{'treatment':<22} {'strategy':<16} {'seed':>4} {'status':<6} {'violations':>10} {'time s':>7}")
+    for r in results:
+        print(
+            f"{r['treatment']:<22} {r['strategy']:<16} {r['seed']:>4} {r['status']:<6} "
+            f"{len(r['violations']):>10} {r['wall_time_s']:>7.1f}"
+        )
+    for r in results:
+        if r['status'] == 'pass':
+            continue
+        print(f"\n-- {r['treatment']} strategy={r['strategy']} seed={r['seed']}: {r['status']}")
+        if r['error']:
+            print(r['error'])
+        for violation in r['violations'][:20]:
+            print(f'  {violation}')
+        if len(r['violations']) > 20:
+            print(f"  ... {len(r['violations']) - 20} more")
+    failed = sum(r['status'] != 'pass' for r in results)
+    slowest = max(r['wall_time_s'] for r in results)
+    print(
+        f"\n{len(results) - failed}/{len(results)} cases passed in {wall_time:.1f}s "
+        f"(slowest case {slowest:.1f}s, sum of cases {sum(r['wall_time_s'] for r in results):.1f}s)"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('treatments', nargs='*', default=TREATMENTS)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help='bot_seed values')
+    parser.add_argument('--strategies', nargs='+', default=['constant'], help='bot_strategy values')
+    parser.add_argument('--groups', type=int, default=1, help='groups per session')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE', help='override a config value')
+    parser.add_argument('--json', dest='json_path', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    overrides = parse_overrides(args.set)
+    cases = [
+        dict(treatment=treatment, strategy=strategy, seed=seed, groups=args.groups, overrides=overrides)
+        for treatment, strategy, seed in itertools.product(args.treatments, args.strategies, args.seeds)
+    ]
+
+    started = time.perf_counter()
+    # ケースごとに新しいプロセス（と新しいメモリ上の DB）を使う
+    with ProcessPoolExecutor(
+        max_workers=min(args.workers, len(cases)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(str(PROJECT_ROOT),),
+        max_tasks_per_child=1,
+    ) as pool:
+        results = list(pool.map(run_case, cases))
+    wall_time = time.perf_counter() - started
+
+    print_report(results, wall_time)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf8') as fp:
+            json.dump(dict(wall_time_s=wall_time, results=results), fp, indent=2)
+    sys.exit(0 if all(r['status'] == 'pass' for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Simulate many synthetic sessions of the game rules offline.
+
+Run from the project root:
+
+    python tools/simulate.py pggp_transfer_cost --sessions 100000
+    python tools/simulate.py pggp_transfer_cost --vary contribution_multiplier=1.2,1.5,2.0 \\
+        --vary punishment_cost=0.5,1 --sessions 20000 --json sim.json
+    python tools/simulate.py pggp_transfer_cost --verify
+
+The rounds are played by game/simulation.py, which uses the same
+settlement functions as the pages but no database. The decisions come
+from the bot strategies (--strategy, as bot_strategy). Every combination
+of the --vary values is simulated; the sessions of each combination are
+split into chunks that run in a process pool (--workers).
+
+--verify plays a real in-memory session with bots, replays the recorded
+decisions through the simulation and checks that every payoff and
+punishment power matches.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def init_worker(project_root):
+    os.chdir(project_root)
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+
+
+def session_config(name, overrides):
+    from settings import SESSION_CONFIG_DEFAULTS, SESSION_CONFIGS
+
+    configs = {config['name']: config for config in SESSION_CONFIGS}
+    if name not in configs:
+        raise SystemExit(f'Unknown session config: {name}')
+    return {**SESSION_CONFIG_DEFAULTS, **configs[name], **overrides}
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_assignments(items, multiple=False):
+    """['key=1,2'] -> {'key': [1, 2]}（multiple=False なら {'key': 1}）"""
+    parsed = {}
+    for item in items or []:
+        key, _, values = item.partition('=')
+        if not values:
+            raise SystemExit(f'Expected key=value: {item}')
+        if multiple:
+            parsed[key] = [parse_value(value) for value in values.split(',')]
+        else:
+            parsed[key] = parse_value(values)
+    return parsed
+
+
+def run_chunk(task):
+    """プロセスプールで実行する 1 チャンク分のセッション"""
+    from game.simulation import simulate_sessions
+
+    return simulate_sessions(**task)
+
+
+def chunks(total, size):
+    for first in range(0, total, size):
+        yield first, min(size, total - first)
+
+
+def simulate_grid(base, grid, *, sessions, groups_per_session, strategy, seed, chunk_size, workers):
+    from game.models import Constants
+    from game.simulation import empty_totals, merge_totals
+
+    keys = sorted(grid)
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(str(PROJECT_ROOT),)
+    ) as pool:
+        results = []
+        for params in combinations:
+            config = dict(base, **params)
+            tasks = [
+                dict(
+                    config=config,
+                    num_sessions=count,
+                    groups_per_session=groups_per_session,
+                    strategy=strategy,
+                    seed=seed,
+                    first_session=first,
+                )
+                for first, count in chunks(sessions, chunk_size)
+            ]
+            started = time.perf_counter()
+            totals = empty_totals(Constants.num_rounds)
+            for chunk_totals in pool.map(run_chunk, tasks):
+                merge_totals(totals, chunk_totals)
+            results.append(
+                dict(params=params, wall_time_s=time.perf_counter() - started, **summarize(config, totals))
+            )
+            print_result(results[-1])
+    return results
+
+
+def summarize(config, totals):
+    """合計値を 1 人・1 ラウンド（max_power は 1 グループ）あたりの平均にする"""
+    from game.models import TreatmentParams
+
+    players = totals['players']
+    groups = players // TreatmentParams.from_config(config).players_per_group
+    rounds = []
+    for stats in totals['rounds']:
+        rounds.append(
+            dict(
+                {key: stats[key] / players for key in stats if key != 'max_power'},
+                max_power=stats['max_power'] / groups,
+            )
+        )
+    return dict(
+        sessions=totals['sessions'],
+        players=players,
+        mean_final_payoff=totals['final_payoff'] / players,
+        rounds=rounds,
+    )
+
+
+def print_result(result):
+    rounds = result['rounds']
+    params = ', '.join(f'{k}={v}' for k, v in result['params'].items()) or 'base config'
+    print(f"\n== {params}: {result['sessions']} sessions in {result['wall_time_s']:.1f}s")
+    print(f"mean final payoff {result['mean_final_payoff']:.2f}")
+    print(f"{'round':>5} {'contrib':>8} {'payoff':>8} {'pun pts':>8} {'loss':>8} {'moved':>8} {'max pow':>8} {'immune':>7}")
+    for round_number, stats in enumerate(rounds, start=1):
+        print(
+            f"{round_number:>5} {stats['contribution']:>8.2f} {stats['payoff']:>8.2f} "
+            f"{stats['punishment_points']:>8.2f} {stats['punishment_loss']:>8.2f} "
+            f"{stats['power_transferred']:>8.2f} {stats['max_power']:>8.2f} {stats['immune_players']:>7.2f}"
+        )
+
+
+class RecordedDecisions:
+    """記録済みの Player から意思決定を読み出す（--verify 用）"""
+
+    def __init__(self, players_by_round):
+        self.players_by_round = players_by_round
+
+    def power_transfers(self, player, round_number, others):
+        return self.players_by_round[round_number].power_transfers_sent()
+
+    def contribution(self, player, round_number):
+        return int(self.players_by_round[round_number].contribution)
+
+    def punishments(self, player, round_number, targets):
+        return self.players_by_round[round_number].punishments_sent()
+
+
+def verify(config_name, strategy, seed, groups):
+    """ボットでセッションを実行し、記録した意思決定をシミュレーションで再生して比較"""
+    os.environ['OTREE_IN_MEMORY'] = '1'
+    from otree.main import setup
+
+    setup()
+    logging.getLogger('otree').setLevel(logging.WARNING)
+
+    import otree.session
+    from otree.bots.runner import SessionBotRunner, make_bots
+    from otree.database import db, session_scope
+
+    from game.models import Constants, Player, TreatmentParams
+    from game.simulation import SimPlayer, SimSession, play_round
+
+    with session_scope():
+        config = session_config(config_name, {})
+        session = otree.session.create_session(
+            session_config_name=config_name,
+            num_participants=groups * TreatmentParams.from_config(config).players_per_group,
+            modified_session_config_fields=dict(bot_strategy=strategy, bot_seed=seed),
+        )
+        bots = make_bots(session_pk=session.id, case_number=None, use_browser_bots=False)
+        db.commit()
+        SessionBotRunner(bots=bots).play()
+        db.commit()
+
+        recorded = {}
+        for player in Player.objects_filter(session=session):
+            recorded.setdefault(player.participant_id, {})[player.round_number] = player
+
+        sim_session = SimSession(session.config)
+        sim_players = {
+            participant_id: SimPlayer(sim_session, index, RecordedDecisions(rounds))
+            for index, (participant_id, rounds) in enumerate(sorted(recorded.items()))
+        }
+        mismatches = 0
+        checked = 0
+        for round_number in range(1, Constants.num_rounds + 1):
+            groups_in_round = {}
+            for participant_id, rounds in recorded.items():
+                groups_in_round.setdefault(rounds[round_number].group_id, []).append(participant_id)
+            for participant_ids in groups_in_round.values():
+                participant_ids.sort(key=lambda pid: recorded[pid][round_number].id_in_group)
+                members = [sim_players[pid] for pid in participant_ids]
+                for pid, member in zip(participant_ids, members):
+                    member.start_round(recorded[pid][round_number].id_in_group)
+                payoffs = play_round(sim_session.params, round_number, members)
+                for pid, member, payoff in zip(participant_ids, members, payoffs):
+                    actual = recorded[pid][round_number]
+                    checked += 1
+                    expected = (float(actual.payoff), actual.punishment_power_after)
+                    if (payoff, member.punishment_power_after) != expected:
+                        mismatches += 1
+                        print(
+                            f'round {round_number} participant {pid}: '
+                            f'simulated {(payoff, member.punishment_power_after)}, recorded {expected}'
+                        )
+    print(f'{config_name}: {checked} player-rounds replayed, {mismatches} mismatches')
+    return mismatches == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('config', help='session config name in settings.py')
+    parser.add_argument('--sessions', type=int, default=1000, help='sessions per combination')
+    parser.add_argument('--groups-per-session', type=int, default=1, help='groups rematched every round')
+    parser.add_argument('--strategy', default='mixed', help='bot_strategy (see game/bot_strategies.py)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE', help='override a config value')
+    parser.add_argument('--vary', action='append', metavar='KEY=V1,V2', help='simulate each value')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--chunk', type=int, default=500, help='sessions per task')
+    parser.add_argument('--json', dest='json_path', help='write the results as JSON')
+    parser.add_argument('--verify', action='store_true', help='check against a real bot session')
+    args = parser.parse_args(argv)
+
+    init_worker(str(PROJECT_ROOT))
+
+    if args.verify:
+        ok = verify(args.config, args.strategy, args.seed, args.groups_per_session)
+        sys.exit(0 if ok else 1)
+
+    base = session_config(args.config, parse_assignments(args.set))
+    results = simulate_grid(
+        base,
+        parse_assignments(args.vary, multiple=True),
+        sessions=args.sessions,
+        groups_per_session=args.groups_per_session,
+        strategy=args.strategy,
+        seed=args.seed,
+        chunk_size=args.chunk,
+        workers=args.workers,
+    )
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf8') as fp:
+            json.dump(dict(config=args.config, strategy=args.strategy, results=results), fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()